@@ -0,0 +1,97 @@
+import argparse
+import datetime
+import os
+import random
+
+import status.incident
+
+
+__all__ = ['statuses', 'generate', 'main']
+
+
+statuses = ['notice', 'resolved', 'outage', 'partial', 'monitoring', 'planned', 'maintenance', 'unknown']
+status_weights = [10, 60, 5, 8, 7, 4, 4, 2]
+
+words = ['database', 'latency', 'elevated', 'errors', 'upstream', 'provider', 'deploy', 'rollback', 'cache', 'network', 'storage', 'queue', 'investigating', 'identified', 'mitigated', 'customers', 'requests', 'timeouts', 'region', 'replica']
+
+
+def sentence(rng, length=None):
+    text = ' '.join(rng.choice(words) for _ in range(length or rng.randint(6, 18)))
+
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng):
+    fragments = [sentence(rng) for _ in range(rng.randint(1, 4))]
+
+    # sprinkle the inline syntax the pymdownx extensions handle
+    kind = rng.randrange(8)
+    if kind == 0:
+        fragments.append(f'See https://example.com/{rng.choice(words)} for details.')
+    elif kind == 1:
+        fragments.append(f'Affected **{rng.choice(words)}** and *{rng.choice(words)}* with `{rng.choice(words)}`.')
+    elif kind == 2:
+        fragments.append(f'The ~~{rng.choice(words)}~~ ^^{rng.choice(words)}^^ "{rng.choice(words)}" was--fixed...')
+
+    return ' '.join(fragments)
+
+
+def content(rng):
+    blocks = []
+
+    for _ in range(rng.randint(1, 5)):
+        kind = rng.randrange(10)
+        if kind == 0:
+            blocks.append('\n'.join(f'- [{rng.choice(" x")}] {sentence(rng, 4)}' for _ in range(rng.randint(2, 5))))
+        elif kind == 1:
+            blocks.append('\n'.join(f'{number}. {sentence(rng, 5)}' for number in range(1, rng.randint(2, 6))))
+        elif kind == 2:
+            blocks.append('```\n' + '\n'.join(sentence(rng, 6) for _ in range(rng.randint(1, 4))) + '\n```')
+        elif kind == 3:
+            blocks.append('| Time | Update |\n| --- | --- |\n' + '\n'.join(f'| {hour:02d}:00 | {sentence(rng, 5)} |' for hour in range(rng.randint(1, 5))))
+        elif kind == 4:
+            blocks.append('### ' + sentence(rng, 3))
+        else:
+            blocks.append(paragraph(rng))
+
+    return '\n\n'.join(blocks)
+
+
+def generate(directory, count, services, *, seed=0, start=None, partitioned=False):
+    rng = random.Random(seed)
+
+    if not start:
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=365 * 3)
+
+    span = (datetime.datetime.now(datetime.timezone.utc) - start).total_seconds()
+
+    os.makedirs(directory, exist_ok=True)
+
+    names = []
+
+    for _ in range(count):
+        date = start + datetime.timedelta(seconds=rng.uniform(0, span))
+        updated = date + datetime.timedelta(minutes=rng.randint(0, 60 * 48))
+
+        affected = rng.sample(services, rng.randint(0, min(4, len(services))))
+
+        names.append(status.incident.create(directory, date=date, updated=updated, title=sentence(rng, rng.randint(2, 6)).rstrip('.'), status=rng.choices(statuses, status_weights)[0], affected=affected, content=content(rng), partitioned=partitioned))
+
+    return names
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='generate a synthetic incident corpus')
+    argparser.add_argument('-n', '--incidents', dest='incidents', type=int, default=1000, help='number of incidents to generate')
+    argparser.add_argument('-s', '--services', dest='services', type=int, default=100, help='number of services incidents can affect')
+    argparser.add_argument('--seed', dest='seed', type=int, default=0, help='random seed')
+    argparser.add_argument('-p', '--partitioned', dest='partitioned', action='store_true', help='write incidents in YYYY/MM/ subdirectories')
+    argparser.add_argument('directory', help='incident directory to write into')
+
+    args = argparser.parse_args()
+
+    generate(args.directory, args.incidents, [f'service{index}' for index in range(args.services)], seed=args.seed, partitioned=args.partitioned)
+
+
+if __name__ == '__main__':
+    main()
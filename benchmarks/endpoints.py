@@ -0,0 +1,105 @@
+import argparse
+import http.server
+import random
+import threading
+import time
+
+import benchmarks.grafana
+
+
+__all__ = ['FakeEndpoints', 'main']
+
+
+class FakeEndpoints:
+    def __init__(self, *, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, slow=(), slow_latency=1.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.slow = set(slow)
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(benchmarks.grafana.KeepAliveHandler):
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests += 1
+                    failed = fake.random.random() < fake.failure_rate
+
+                endpoint = self.path.strip('/')
+
+                latency = fake.slow_latency if endpoint in fake.slow else fake.latency
+                if latency:
+                    time.sleep(latency)
+
+                data = b'failing\n' if failed else b'ok\n'
+
+                self.send_response(503 if failed else 200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+
+                self.wfile.write(data)
+
+        # hundreds of probes connect at once so the listen backlog has to be deeper than the default
+        class Server(http.server.ThreadingHTTPServer):
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+
+        self.thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def url(self, endpoint):
+        return f'http://{self.host}:{self.port}/{endpoint}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='stand-in HTTP endpoints for the http and tcp backends')
+    argparser.add_argument('-b', '--bind', dest='host', default='127.0.0.1', help='address to listen on')
+    argparser.add_argument('-p', '--port', dest='port', type=int, default=8001, help='port to listen on')
+    argparser.add_argument('-l', '--latency', dest='latency', type=float, default=0.0, help='seconds to delay every response')
+    argparser.add_argument('-f', '--failure-rate', dest='failure_rate', type=float, default=0.0, help='fraction of requests answered with an error')
+    argparser.add_argument('-s', '--slow', dest='slow', nargs='*', default=[], help='endpoints that answer after --slow-latency instead')
+    argparser.add_argument('--slow-latency', dest='slow_latency', type=float, default=1.0, help='seconds slow endpoints take to answer')
+
+    args = argparser.parse_args()
+
+    fake = FakeEndpoints(host=args.host, port=args.port, latency=args.latency, failure_rate=args.failure_rate, slow=args.slow, slow_latency=args.slow_latency)
+    print(f'serving endpoints on {fake.url("")}')
+
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import http.server
+import json
+import random
+import re
+import threading
+import time
+
+
+__all__ = ['KeepAliveHandler', 'FakeGrafana', 'main']
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in separate writes which Nagle would hold back on kept alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGrafana:
+    def __init__(self, *, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, states=None, missing=(), seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.states = states if states is not None else {}
+        self.missing = set(missing)
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(KeepAliveHandler):
+            def respond(self, code, body):
+                data = json.dumps(body).encode('utf-8')
+
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests += 1
+                    failed = fake.random.random() < fake.failure_rate
+
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if failed:
+                    self.respond(500, {'message': 'injected failure'})
+                    return
+
+                match = re.match(r'^/api/alerts/([0-9]+)$', self.path)
+                if match:
+                    if int(match.group(1)) in fake.missing:
+                        self.respond(404, {'message': 'alert not found'})
+                    else:
+                        self.respond(200, {'Id': int(match.group(1)), 'State': fake.state(int(match.group(1)))})
+                elif re.match(r'^/api/alerts/?(\?.*)?$', self.path):
+                    self.respond(200, [{'id': alert_id, 'state': fake.state(alert_id)} for alert_id in sorted(fake.states) if alert_id not in fake.missing])
+                else:
+                    self.respond(404, {'message': 'not found'})
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+        self.thread = None
+
+    def state(self, alert_id):
+        return self.states.get(alert_id, 'ok')
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address[:2]
+
+        return f'http://{host}:{port}/api'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='stand-in Grafana alert API')
+    argparser.add_argument('-b', '--bind', dest='host', default='127.0.0.1', help='address to listen on')
+    argparser.add_argument('-p', '--port', dest='port', type=int, default=8000, help='port to listen on')
+    argparser.add_argument('-l', '--latency', dest='latency', type=float, default=0.0, help='seconds to delay every response')
+    argparser.add_argument('-f', '--failure-rate', dest='failure_rate', type=float, default=0.0, help='fraction of requests answered with an error')
+    argparser.add_argument('-n', '--alerts', dest='alerts', type=int, default=100, help='number of alerts to serve')
+
+    args = argparser.parse_args()
+
+    states = {alert_id: random.choice(['ok', 'ok', 'ok', 'pending', 'alerting', 'paused', 'no_data']) for alert_id in range(1, args.alerts + 1)}
+
+    fake = FakeGrafana(host=args.host, port=args.port, latency=args.latency, failure_rate=args.failure_rate, states=states)
+    print(f'serving {args.alerts} alerts on {fake.api_base}')
+
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import datetime
+import json
+import os.path
+import random
+
+import dateutil.parser
+
+import status.incident
+
+import benchmarks.corpus
+import benchmarks.suite
+
+
+__all__ = ['make_entries', 'as_dict', 'as_incident', 'run', 'main']
+
+
+def make_entries(count, services, *, seed=0, content=True):
+    rng = random.Random(seed)
+
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=365 * 3)
+    span = (datetime.datetime.now(datetime.timezone.utc) - start).total_seconds()
+
+    entries = []
+
+    for number in range(count):
+        date = start + datetime.timedelta(seconds=rng.uniform(0, span))
+        updated = date + datetime.timedelta(minutes=rng.randint(0, 60 * 48))
+
+        entry = {
+            'name': date.strftime('%Y-%m-%d') + f'-incident-{number}',
+            'title': benchmarks.corpus.sentence(rng, rng.randint(2, 6)).rstrip('.'),
+            'date': date.isoformat(),
+            'updated': updated.isoformat(),
+            'status': rng.choices(benchmarks.corpus.statuses, benchmarks.corpus.status_weights)[0],
+            'affected': rng.sample(services, rng.randint(0, min(4, len(services)))),
+        }
+
+        if content:
+            entry['content'] = benchmarks.corpus.content(rng)
+
+        # kept encoded so every string is built fresh when decoded, as it is when reading the incident index
+        entries.append(json.dumps(entry))
+
+    return entries
+
+
+def as_dict(entry):
+    return {**entry, 'date': dateutil.parser.isoparse(entry['date']), 'updated': dateutil.parser.isoparse(entry['updated'])}
+
+
+def as_incident(entry):
+    incident = status.incident.Incident(entry['name'], entry['title'], dateutil.parser.isoparse(entry['date']), dateutil.parser.isoparse(entry['updated']), entry['status'], entry['affected'], entry.get('content'), filename=os.path.join('incidents', entry['name'] + '.md'))
+
+    if 'content' not in entry:
+        # what load_content leaves behind for content that has not been used yet
+        incident.requested = True
+
+    return incident
+
+
+def run(count, service_count, *, report=print):
+    services = [f'service{index}' for index in range(service_count)]
+
+    full = make_entries(count, services)
+    headers = make_entries(count, services, content=False)
+
+    report(f'{"representation":32} {"incidents":>9} {"seconds":>10} {"MiB":>9} {"bytes each":>11}')
+
+    def line(representation, elapsed, retained):
+        report(f'{representation:32} {count:9} {elapsed:10.3f} {retained / 1024 / 1024:9.1f} {retained / count:11.0f}')
+
+    for representation, entries, build in [
+        ('dict (with content)', full, as_dict),
+        ('Incident (with content)', full, as_incident),
+        ('dict (without content)', headers, as_dict),
+        ('Incident (lazy content)', headers, as_incident),
+    ]:
+        incidents, elapsed, retained = benchmarks.suite.measure(lambda: [build(json.loads(entry)) for entry in entries], retained=True)
+        line(representation, elapsed, retained)
+
+        del incidents
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='compare memory held by incidents as plain dicts and as Incident objects')
+    argparser.add_argument('-n', '--incidents', dest='incidents', type=int, default=100000, help='number of incidents')
+    argparser.add_argument('-s', '--services', dest='services', type=int, default=100, help='number of services incidents can affect')
+
+    args = argparser.parse_args()
+
+    run(args.incidents, args.services, report=(lambda text: print(text, flush=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import os
+import os.path
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+
+__all__ = ['measure', 'main']
+
+
+budgets = {
+    'new-incident': 40,
+    'edit-incident': 40,
+    'run': 400,
+    'watch': 400,
+}
+
+heavy_modules = ['markdown', 'pymdownx', 'feedgen', 'lxml', 'httpx']
+
+authoring_commands = {'new-incident', 'edit-incident'}
+
+
+def parse_importtime(stderr):
+    imports = []
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.rstrip()[1:], int(cumulative)))
+
+    return imports
+
+
+def summarize(imports):
+    # only count what status pulls in on top of interpreter startup
+    total = 0
+    counting = False
+
+    for name, cumulative in imports:
+        if name == 'status':
+            counting = True
+
+        if counting and not name.startswith(' '):
+            total += cumulative
+
+    return total / 1000, {name.strip().split('.')[0] for name, _ in imports}
+
+
+def measure(command, directory, config, output):
+    base = [sys.executable, '-X', 'importtime', '-m', 'status', '-d', directory]
+
+    if command == 'new-incident':
+        process = subprocess.run(base + ['new-incident', '--title', 'Startup benchmark', 'startup-benchmark'], input='benchmark\n', capture_output=True, text=True)
+    elif command == 'edit-incident':
+        process = subprocess.run(base + ['edit-incident', '--status', 'resolved', 'startup-benchmark'], input='benchmark\n', capture_output=True, text=True)
+    elif command == 'run':
+        process = subprocess.run(base + ['run', '-c', config, '-o', output], capture_output=True, text=True)
+    elif command == 'watch':
+        watch_output = tempfile.mkdtemp(prefix='watch-', dir=os.path.dirname(output))
+        # a file rather than a pipe so the resident process can never block writing its import report
+        with tempfile.TemporaryFile('w+') as stderr:
+            process = subprocess.Popen(base + ['watch', '-c', config, '-o', watch_output], stderr=stderr, text=True)
+
+            while process.poll() is None and not os.path.exists(os.path.join(watch_output, 'feed.rss')):
+                time.sleep(0.05)
+
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+            stderr.seek(0)
+            process.stderr = stderr.read()
+    else:
+        raise ValueError(f'unknown command {command}')
+
+    return summarize(parse_importtime(process.stderr))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='measure import time of each status subcommand against a budget')
+    argparser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5, help='number of runs per command (best is reported)')
+    argparser.add_argument('-b', '--budget', dest='budgets', action='append', default=[], metavar='COMMAND=MS', help='override import time budget for a command')
+    argparser.add_argument('commands', nargs='*', default=list(budgets), help='commands to measure')
+
+    args = argparser.parse_args()
+
+    command_budgets = dict(budgets)
+    for budget in args.budgets:
+        command, _, milliseconds = budget.partition('=')
+        command_budgets[command] = float(milliseconds)
+
+    failed = False
+
+    with tempfile.TemporaryDirectory() as scratch:
+        config = os.path.join(scratch, 'config.cfg')
+        with open(config, 'w') as config_file:
+            # nothing listens on the discard port so polling fails fast
+            config_file.write(textwrap.dedent('''
+            [GLOBAL]
+            title = Startup Benchmark
+            api_base = http://127.0.0.1:9/api
+            api_key = benchmark
+            timeout = 0.5
+
+            [service]
+            id = 1
+            title = Service
+            link = https://example.com/
+            description = Benchmark service
+            ''').lstrip())
+
+        for command in args.commands:
+            best = None
+
+            for _ in range(args.repeat):
+                milliseconds, modules = measure(command, os.path.join(scratch, 'incidents'), config, os.path.join(scratch, 'output'))
+                best = milliseconds if best is None else min(best, milliseconds)
+
+            heavy = sorted(module for module in heavy_modules if module in modules) if command in authoring_commands else []
+            over = best > command_budgets[command]
+
+            print(f'{command:15} {best:8.1f} ms (budget {command_budgets[command]:.0f} ms){" OVER BUDGET" if over else ""}{" imports " + ", ".join(heavy) if heavy else ""}')
+
+            failed = failed or over or bool(heavy)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
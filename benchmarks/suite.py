@@ -0,0 +1,137 @@
+import argparse
+import datetime
+import gc
+import os.path
+import tempfile
+import time
+import tracemalloc
+
+import status.generate
+import status.grafana
+import status.incident
+import status.probe
+
+import benchmarks.corpus
+import benchmarks.endpoints
+import benchmarks.grafana
+
+
+__all__ = ['measure', 'run', 'main']
+
+
+def measure(function, *, setup=None, memory=True, retained=False):
+    if setup:
+        setup()
+
+    gc.collect()
+
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+
+    peak = None
+
+    if memory:
+        # a second pass under tracemalloc so its overhead stays out of the timing
+        result = None
+
+        if setup:
+            setup()
+
+        gc.collect()
+
+        tracemalloc.start()
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # what the result still holds once its temporaries are freed rather than the high water mark
+        if retained:
+            peak = current
+
+    return result, elapsed, peak
+
+
+def reset_render_cache():
+    status.generate.render_cache = status.generate.RenderCache()
+
+
+def make_services(count):
+    return {f'service{index}': {'id': str(index + 1), 'title': f'Service {index}', 'link': f'https://example.com/service{index}', 'description': f'Synthetic service {index}'} for index in range(count)}
+
+
+def run(incident_counts, service_counts, *, latency=0.0, failure_rate=0.0, concurrency=8, memory=True, report=print):
+    config = {'title': 'Benchmark Status'}
+    now = datetime.datetime.now().astimezone()
+
+    report(f'{"stage":24} {"incidents":>9} {"services":>8} {"seconds":>10} {"peak MiB":>9}')
+
+    def line(stage, incidents, services, elapsed, peak):
+        report(f'{stage:24} {incidents:9} {services:8} {elapsed:10.3f} ' + (f'{peak / 1024 / 1024:9.1f}' if peak is not None else f'{"-":>9}'))
+
+    with tempfile.TemporaryDirectory() as scratch:
+        max_services = max(service_counts)
+
+        for count in incident_counts:
+            directory = os.path.join(scratch, f'incidents-{count}')
+            benchmarks.corpus.generate(directory, count, list(make_services(max_services)))
+
+            _, elapsed, peak = measure(lambda: status.incident.get_all(directory, rebuild_index=True), memory=memory)
+            line('get_all (cold index)', count, max_services, elapsed, peak)
+
+            incidents, elapsed, peak = measure(lambda: status.incident.get_all(directory), memory=memory)
+            line('get_all (warm index)', count, max_services, elapsed, peak)
+
+            services = make_services(max_services)
+            statuses = {service: 'up' for service in services}
+
+            _, elapsed, peak = measure(lambda: status.generate.generate_html(config, now, services, statuses, incidents), setup=reset_render_cache, memory=memory)
+            line('generate_html', count, max_services, elapsed, peak)
+
+            _, elapsed, peak = measure(lambda: status.generate.generate_json(config, now, services, statuses, incidents), memory=memory)
+            line('generate_json', count, max_services, elapsed, peak)
+
+            feed, elapsed, peak = measure(lambda: status.generate.create_feed(config, now, incidents), memory=memory)
+            line('create_feed', count, max_services, elapsed, peak)
+
+            _, elapsed, peak = measure(lambda: (feed.atom_str(pretty=True), feed.rss_str(pretty=True)), memory=memory)
+            line('feed serialization', count, max_services, elapsed, peak)
+
+            del incidents, feed
+
+        for count in service_counts:
+            services = make_services(count)
+
+            with benchmarks.grafana.FakeGrafana(latency=latency, failure_rate=failure_rate, states={int(info['id']): 'ok' for info in services.values()}) as fake:
+                _, elapsed, peak = measure(lambda: status.grafana.check(fake.api_base, 'benchmark', services, concurrency=concurrency), memory=memory)
+                line('grafana.check', 0, count, elapsed, peak)
+
+                _, elapsed, peak = measure(lambda: status.grafana.check(fake.api_base, 'benchmark', services, concurrency=concurrency, bulk=True), memory=memory)
+                line('grafana.check (bulk)', 0, count, elapsed, peak)
+
+            with benchmarks.endpoints.FakeEndpoints(latency=latency, failure_rate=failure_rate) as fake:
+                endpoints = {service: {'backend': 'http', 'url': fake.url(service)} for service in services}
+                _, elapsed, peak = measure(lambda: status.probe.check(endpoints, concurrency=concurrency * 8), memory=memory)
+                line('probe.check (http)', 0, count, elapsed, peak)
+
+                endpoints = {service: {'backend': 'tcp', 'host': fake.host, 'port': fake.port} for service in services}
+                _, elapsed, peak = measure(lambda: status.probe.check(endpoints, concurrency=concurrency * 8), memory=memory)
+                line('probe.check (tcp)', 0, count, elapsed, peak)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='time each stage of status generation against a synthetic corpus')
+    argparser.add_argument('-n', '--incidents', dest='incidents', type=int, nargs='+', default=[100, 10000, 100000], help='incident corpus sizes')
+    argparser.add_argument('-s', '--services', dest='services', type=int, nargs='+', default=[10, 100, 1000], help='service counts')
+    argparser.add_argument('-l', '--latency', dest='latency', type=float, default=0.0, help='stand-in Grafana response latency in seconds')
+    argparser.add_argument('-f', '--failure-rate', dest='failure_rate', type=float, default=0.0, help='fraction of stand-in Grafana requests that fail')
+    argparser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=8, help='concurrent Grafana requests')
+    argparser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc pass that measures peak memory')
+
+    args = argparser.parse_args()
+
+    run(args.incidents, args.services, latency=args.latency, failure_rate=args.failure_rate, concurrency=args.concurrency, memory=args.memory, report=(lambda text: print(text, flush=True)))
+
+
+if __name__ == '__main__':
+    main()
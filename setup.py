@@ -41,7 +41,8 @@ setup(
     author='Lily Foster',
     author_email='lily@lily.flowers',
     install_requires=['httpx', 'python-dateutil', 'markdown', 'pymdown-extensions', 'feedgen'],
-    packages=find_packages(),
+    extras_require={'brotli': ['brotli'], 'history': ['numpy']},
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
     package_data={'': ['html/*.*']},
     entry_points={'console_scripts': ['status = status.__main__:main']},
 )
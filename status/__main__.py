@@ -1,20 +1,208 @@
 import argparse
-import configparser
-import datetime
 import os
 import os.path
 import subprocess
 import sys
 
-import dateutil.parser
-import dateutil.tz
 
-import status.generate
-import status.grafana
-import status.incident
+__all__ = ['main']
 
 
-__all__ = ['main']
+def edit(filename):
+    subprocess.run([os.environ.get('EDITOR', 'vi'), filename])
+
+    # editors may write in place so make sure the incident index notices the change to its directory
+    os.utime(os.path.dirname(filename))
+
+
+def prepare(args):
+    import importlib.util
+
+    import status.generate
+    import status.output
+
+    if any(name not in status.output.compressors for name in getattr(args, 'precompress', [])):
+        sys.exit('status: precompressing with brotli requires the brotli package')
+
+    # numpy is only looked for here since importing it would slow down every run
+    if args.history and not importlib.util.find_spec('numpy'):
+        sys.exit('status: status history requires the numpy package')
+
+    if args.render_cache:
+        status.generate.render_cache = status.generate.RenderCache(directory=args.render_cache)
+
+
+def run(args):
+    import datetime
+
+    import dateutil.tz
+
+    import status.generate
+    import status.history
+    import status.metrics
+    import status.output
+    import status.site
+
+    prepare(args)
+
+    if args.timings or args.metrics_file:
+        status.metrics.metrics = status.metrics.Metrics()
+
+    metrics = status.metrics.metrics
+
+    try:
+        with metrics.stage('config'):
+            gconfig, services = status.site.load_config(args.config)
+            sites = status.site.load_sites(gconfig, services, output=args.output, template=args.template)
+
+        with metrics.stage('poll'):
+            # without a cache key the last known statuses live with the first site's outputs
+            statuses, stale = status.site.poll(gconfig, services, output=sites[0].output)
+    except ValueError as err:
+        sys.exit(f'status: {err}')
+
+    now = datetime.datetime.now().astimezone(dateutil.tz.gettz(args.timezone))
+
+    uptime = None
+    if args.history:
+        with metrics.stage('history'):
+            # cached statuses were not actually observed this run so they go into the history as unknown
+            status.history.record(args.history, now, {service: ('unknown' if service in stale else value) for service, value in statuses.items()})
+            uptime = status.history.uptime(args.history, services, now)
+
+    with metrics.stage('collect'):
+        incidents = status.site.collect(args.directory, now, args.days, timezone=args.timezone, partitioned=args.partitioned, rebuild_index=args.rebuild_index)
+
+    # markdown rendered for the first site is served from memory to the rest so it has to fit every incident
+    if len(sites) > 1:
+        status.generate.render_cache.size = max(status.generate.render_cache.size, 2 * len(incidents))
+
+    archive = None
+    if any(site.config.getboolean('feed_archive', False) or site.config.getboolean('html_archive', False) for site in sites):
+        with metrics.stage('collect_all'):
+            archive = status.site.collect_all(args.directory, timezone=args.timezone, partitioned=args.partitioned)
+
+    for site in sites:
+        status.site.write(site.output, site.config, now, site.services, site.statuses(statuses), site.incidents(incidents), templates=site.templates, compress=args.precompress, jobs=args.jobs, uptime=uptime, stale=stale, archive=(site.incidents(archive) if archive is not None else None))
+
+        if site.config.getboolean('html_archive', False):
+            with metrics.stage('html_archive'):
+                status.site.write_html_archive(site.output, site.config, site.services, site.incidents(archive), templates=site.templates, compress=args.precompress)
+
+    status.generate.render_cache.prune()
+
+    metrics.set('render_cache_hits', status.generate.render_cache.hits)
+    metrics.set('render_cache_misses', status.generate.render_cache.misses)
+
+    if args.metrics_file:
+        metrics.write(args.metrics_file)
+
+    if args.timings:
+        metrics.report(sys.stderr)
+
+
+def watch(args):
+    import status.watch
+
+    prepare(args)
+
+    try:
+        status.watch.watch(args.config, args.directory, args.output, days=args.days, interval=args.interval, poll_interval=args.poll_interval, timezone=args.timezone, partitioned=args.partitioned, template_directory=args.template, rebuild_index=args.rebuild_index, compress=args.precompress, jobs=args.jobs, timings=args.timings, metrics_file=args.metrics_file, history=args.history)
+    except ValueError as err:
+        sys.exit(f'status: {err}')
+
+
+def serve(args):
+    import status.serve
+
+    prepare(args)
+
+    try:
+        status.serve.serve(args.config, args.directory, host=args.bind, port=args.port, site=args.site, days=args.days, interval=args.interval, poll_interval=args.poll_interval, timezone=args.timezone, partitioned=args.partitioned, template_directory=args.template, rebuild_index=args.rebuild_index, history=args.history)
+    except ValueError as err:
+        sys.exit(f'status: {err}')
+
+
+def new_incident(args):
+    import dateutil.parser
+    import dateutil.tz
+
+    import status.incident
+
+    info = {}
+    if args.date:
+        info['date'] = dateutil.parser.isoparse(args.date).astimezone(dateutil.tz.gettz(args.timezone))
+    if args.updated:
+        info['updated'] = dateutil.parser.isoparse(args.updated).astimezone(dateutil.tz.gettz(args.timezone))
+    if args.title:
+        info['title'] = args.title
+    if args.status:
+        info['status'] = args.status
+    if args.affected:
+        info['affected'] = args.affected
+    if args.name:
+        info['name'] = args.name
+
+    if sys.stdin.isatty():
+        name = status.incident.create(args.directory, **info, timezone=args.timezone, partitioned=args.partitioned)
+        edit(status.incident.get_filename(args.directory, name, partitioned=args.partitioned))
+        status.incident.rename(args.directory, name, partitioned=args.partitioned)
+    else:
+        status.incident.create(args.directory, **info, content=sys.stdin.read(), timezone=args.timezone, partitioned=args.partitioned)
+
+
+def edit_incident(args):
+    import dateutil.parser
+    import dateutil.tz
+
+    import status.incident
+
+    info = {}
+    if args.date:
+        info['date'] = dateutil.parser.isoparse(args.date).astimezone(dateutil.tz.gettz(args.timezone))
+    if args.updated:
+        info['updated'] = dateutil.parser.isoparse(args.updated).astimezone(dateutil.tz.gettz(args.timezone))
+    if args.title:
+        info['title'] = args.title
+    if args.status:
+        info['status'] = args.status
+    if args.affected:
+        info['affected'] = args.affected
+
+    if sys.stdin.isatty():
+        name = status.incident.modify(args.directory, args.name, **info, timezone=args.timezone, partitioned=args.partitioned)
+        edit(status.incident.get_filename(args.directory, name, partitioned=args.partitioned))
+    else:
+        status.incident.modify(args.directory, args.name, **info, content=sys.stdin.read(), timezone=args.timezone, partitioned=args.partitioned)
+
+
+def batch(args):
+    import json
+
+    import status.incident
+
+    operations = []
+
+    with (open(args.file, 'r') if args.file != '-' else sys.stdin) as operations_file:
+        for number, line in enumerate(operations_file, 1):
+            if not line.strip():
+                continue
+
+            try:
+                operations.append(json.loads(line))
+            except ValueError as err:
+                sys.exit(f'status: line {number}: {err}')
+
+    try:
+        summary = status.incident.batch(args.directory, operations, timezone=args.timezone, partitioned=args.partitioned)
+    except ValueError as err:
+        sys.exit(f'status: {err}')
+
+    for action, name, old_status, new_status in summary:
+        print(f'{action} {name} ({new_status})' if old_status is None or old_status == new_status else f'{action} {name} ({old_status} -> {new_status})')
+
+    created = sum(1 for action, _, _, _ in summary if action == 'created')
+    print(f'{created} created, {len(summary) - created} updated')
 
 
 def main():
@@ -22,16 +210,43 @@ def main():
 
     argparser.add_argument('-d', '--directory', dest='directory', default='.', help='directory containing incident info')
     argparser.add_argument('-z', '--timezone', dest='timezone', help='alternative timezone for output')
+    argparser.add_argument('-p', '--partitioned', dest='partitioned', action='store_true', help='store incidents in YYYY/MM/ subdirectories of the incident directory')
 
     commands = argparser.add_subparsers(dest='command')
 
-    command_run = commands.add_parser('run', help='generate status page')
-    command_run.add_argument('-c', '--config', dest='config', required=True, metavar='CONFIG.cfg', help='generation configuration file describing metadata, grafana connection, services')
-    command_run.add_argument('-o', '--output', dest='output', default='.', help='output directory (generates index.html, status.json, feed.atom, and feed.rss)')
-    command_run.add_argument('-t', '--template', dest='template', help='input template directory')
-    command_run.add_argument('-i', '--incident-days', dest='days', type=int, default=7, help='number of days of resolved incidents to show')
+    generate_arguments = argparse.ArgumentParser(add_help=False)
+    generate_arguments.add_argument('-c', '--config', dest='config', required=True, metavar='CONFIG.cfg', help='generation configuration file describing metadata, grafana connection, services, and optionally [SITE:name] sections each generating its own page')
+    generate_arguments.add_argument('-t', '--template', dest='template', help='input template directory')
+    generate_arguments.add_argument('-i', '--incident-days', dest='days', type=int, default=7, help='number of days of resolved incidents to show')
+    generate_arguments.add_argument('--render-cache', dest='render_cache', help='directory to cache rendered incident markdown in between runs')
+    generate_arguments.add_argument('--history', dest='history', help='directory to record service status history in and compute uptime from (requires numpy)')
+    generate_arguments.add_argument('--rebuild-index', dest='rebuild_index', action='store_true', help='reparse every incident and rebuild the incident index')
+
+    run_arguments = argparse.ArgumentParser(add_help=False, parents=[generate_arguments])
+    run_arguments.add_argument('-o', '--output', dest='output', default='.', help='output directory (generates index.html, status.json, feed.atom, and feed.rss) when the configuration has no [SITE:name] sections')
+    run_arguments.add_argument('--precompress', dest='precompress', nargs='+', default=[], choices=['gzip', 'brotli'], help='also write precompressed copies of outputs (gzip, or brotli when installed)')
+    run_arguments.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='number of processes to render incident markdown with')
+    run_arguments.add_argument('--timings', dest='timings', action='store_true', help='print how long each stage took to stderr')
+    run_arguments.add_argument('--metrics-file', dest='metrics_file', metavar='FILE.prom', help='write run metrics in prometheus textfile collector format')
+
+    resident_arguments = argparse.ArgumentParser(add_help=False)
+    resident_arguments.add_argument('--interval', dest='interval', type=float, default=60, help='seconds between status polls')
+    resident_arguments.add_argument('--poll-interval', dest='poll_interval', type=float, default=5, help='seconds between incident directory scans (watch only rescans when inotify is unavailable)')
+
+    command_run = commands.add_parser('run', parents=[run_arguments], help='generate status page')
+    command_run.set_defaults(func=run)
+
+    command_watch = commands.add_parser('watch', parents=[run_arguments, resident_arguments], help='stay resident and regenerate status page when statuses or incidents change (SIGHUP reloads configuration)')
+    command_watch.set_defaults(func=watch)
+
+    command_serve = commands.add_parser('serve', parents=[generate_arguments, resident_arguments], help='serve status page, status.json, and feeds from memory with an /events stream of status changes (SIGHUP reloads configuration)')
+    command_serve.set_defaults(func=serve)
+    command_serve.add_argument('-s', '--site', dest='site', help='[SITE:name] section to serve (default first site)')
+    command_serve.add_argument('-b', '--bind', dest='bind', default='127.0.0.1', help='address to listen on')
+    command_serve.add_argument('-P', '--port', dest='port', type=int, default=8000, help='port to listen on')
 
     command_new_incident = commands.add_parser('new-incident', help='create new incident from arguments (markdown content can be piped to stdin)')
+    command_new_incident.set_defaults(func=new_incident)
     command_new_incident.add_argument('--date', dest='date', help='date of incident')
     command_new_incident.add_argument('--updated', dest='updated', help='last updated date of incident')
     command_new_incident.add_argument('--title', dest='title', help='title of incident')
@@ -40,6 +255,7 @@ def main():
     command_new_incident.add_argument('name', nargs='?', help='slug name for incident')
 
     command_edit_incident = commands.add_parser('edit-incident', help='modify existing incident from arguments (markdown content can be piped to stdin)')
+    command_edit_incident.set_defaults(func=edit_incident)
     command_edit_incident.add_argument('--date', dest='date', help='date of incident')
     command_edit_incident.add_argument('--updated', dest='updated', help='last updated date of incident')
     command_edit_incident.add_argument('--title', dest='title', help='title of incident')
@@ -47,6 +263,10 @@ def main():
     command_edit_incident.add_argument('--affected', dest='affected', nargs='*', help='services affected (specify multiple times per service)')
     command_edit_incident.add_argument('name', help='slug name for incident')
 
+    command_batch = commands.add_parser('batch', help='apply create, edit, and resolve operations from a stream of JSON lines in one pass')
+    command_batch.set_defaults(func=batch)
+    command_batch.add_argument('file', nargs='?', default='-', help='file of operations, one JSON object per line, like {"op": "resolve", "service": "api", "content": "Fixed."} (default stdin)')
+
     args = argparser.parse_args()
     if not args.command:
         argparser.print_usage()
@@ -54,81 +274,7 @@ def main():
 
     os.makedirs(args.directory, exist_ok=True)
 
-    if args.command == 'run':
-        config = configparser.ConfigParser()
-        config.read(args.config)
-
-        services = {section: config[section] for section in config.sections() if section != 'GLOBAL'}
-
-        gconfig = config['GLOBAL']
-
-        statuses = status.grafana.check(os.environ.get('GRAFANA_API_BASE') or gconfig['api_base'], os.environ.get('GRAFANA_API_KEY') or gconfig['api_key'], services)
-        incidents = status.incident.get_all(args.directory, args.timezone)
-
-        now = datetime.datetime.now().astimezone(dateutil.tz.gettz(args.timezone))
-
-        for incident in incidents[:]:
-            if args.days and incident['updated'] >= (now - datetime.timedelta(days=args.days)):
-                continue
-
-            if incident['status'] == 'notice' or incident['status'] == 'resolved':
-                incidents.remove(incident)
-
-        os.makedirs(args.output, exist_ok=True)
-
-        with open(os.path.join(args.output, 'index.html'), 'w') as output_html:
-            output_html.write(status.generate.generate_html(gconfig, now, services, statuses, incidents, template_directory=args.template))
-
-        with open(os.path.join(args.output, 'status.json'), 'w') as output_json:
-            output_json.write(status.generate.generate_json(gconfig, now, services, statuses, incidents))
-
-        with open(os.path.join(args.output, 'feed.atom'), 'wb') as output_atom:
-            output_atom.write(status.generate.generate_atom(gconfig, now, incidents))
-
-        with open(os.path.join(args.output, 'feed.rss'), 'wb') as output_rss:
-            output_rss.write(status.generate.generate_rss(gconfig, now, incidents))
-    elif args.command == 'new-incident':
-        info = {}
-        if args.date:
-            info['date'] = dateutil.parser.isoparse(args.date).astimezone(dateutil.tz.gettz(args.timezone))
-        if args.updated:
-            info['updated'] = dateutil.parser.isoparse(args.updated).astimezone(dateutil.tz.gettz(args.timezone))
-        if args.title:
-            info['title'] = args.title
-        if args.status:
-            info['status'] = args.status
-        if args.affected:
-            info['affected'] = args.affected
-        if args.name:
-            info['name'] = args.name
-
-        if sys.stdin.isatty():
-            name = status.incident.create(args.directory, **info, timezone=args.timezone)
-            subprocess.run([os.environ.get('EDITOR', 'vi'), status.incident.get_filename(args.directory, name)])
-            status.incident.rename(args.directory, name)
-        else:
-            status.incident.create(args.directory, **info, content=sys.stdin.read(), timezone=args.timezone)
-    elif args.command == 'edit-incident':
-        info = {}
-        if args.date:
-            info['date'] = dateutil.parser.isoparse(args.date).astimezone(dateutil.tz.gettz(args.timezone))
-        if args.updated:
-            info['updated'] = dateutil.parser.isoparse(args.updated).astimezone(dateutil.tz.gettz(args.timezone))
-        if args.title:
-            info['title'] = args.title
-        if args.status:
-            info['status'] = args.status
-        if args.affected:
-            info['affected'] = args.affected
-
-        if sys.stdin.isatty():
-            name = status.incident.modify(args.directory, args.name, **info, timezone=args.timezone)
-            subprocess.run([os.environ.get('EDITOR', 'vi'), status.incident.get_filename(args.directory, name)])
-        else:
-            status.incident.modify(args.directory, args.name, **info, content=sys.stdin.read(), timezone=args.timezone)
-    else:
-        argparser.print_usage()
-        sys.exit(1)
+    args.func(args)
 
 
 if __name__ == '__main__':
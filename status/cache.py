@@ -0,0 +1,50 @@
+import json
+import os
+import os.path
+
+
+__all__ = ['StatusCache']
+
+
+class StatusCache:
+    def __init__(self, filename, *, ttl=3600.0):
+        self.filename = filename
+        self.ttl = ttl
+
+        try:
+            with open(filename, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            cache = {}
+
+        self.statuses = cache.get('statuses', {})
+        self.breaker = cache.get('breaker', {})
+
+    def resolve(self, now, statuses):
+        resolved = {}
+        stale = {}
+
+        for service, status in statuses.items():
+            if status is not None:
+                self.statuses[service] = {'status': status, 'checked': now}
+                resolved[service] = status
+                continue
+
+            # a failed check falls back to the last status a backend gave until it is too old to trust
+            entry = self.statuses.get(service)
+            if entry and now - entry['checked'] <= self.ttl:
+                resolved[service] = entry['status']
+                stale[service] = entry['checked']
+            else:
+                resolved[service] = 'unknown'
+
+        return resolved, stale
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+
+        with open(self.filename + '.tmp', 'w') as cache_file:
+            json.dump({'statuses': self.statuses, 'breaker': self.breaker}, cache_file, indent=2)
+            cache_file.write('\n')
+
+        os.replace(self.filename + '.tmp', self.filename)
@@ -1,13 +1,31 @@
+import collections
+import concurrent.futures
+import datetime
+import hashlib
 import html
+import io
 import json
+import os
 import os.path
+import re
+import string
 
 import markdown
 
+import feedgen.ext.base
 import feedgen.feed
 
+import status.incident
+import status.metrics
 
-__all__ = ['generate_html', 'generate_json', 'generate_atom', 'generate_rss']
+
+__all__ = ['RenderCache', 'TemplateSet', 'write_html', 'write_service_html', 'generate_html', 'write_history_html', 'write_history_index_html', 'write_json', 'write_json_page', 'generate_json', 'generate_feeds', 'generate_atom', 'generate_rss', 'generate_service_atom', 'generate_archive_atom']
+
+
+markdown_extensions = ['sane_lists', 'smarty', 'pymdownx.extra', 'pymdownx.caret', 'pymdownx.magiclink', 'pymdownx.saneheaders', 'pymdownx.tasklist', 'pymdownx.tilde']
+markdown_output_format = 'xhtml'
+
+parallel_threshold = 32
 
 
 pretty_service_statuses = {
@@ -30,8 +48,164 @@ pretty_incident_statuses = {
 }
 
 
+class RenderCache:
+    def __init__(self, *, size=4096, directory=None, directory_size=64 * 1024 * 1024):
+        self.size = size
+        self.directory = directory
+        self.directory_size = directory_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self.engine = None
+        self.entries = collections.OrderedDict()
+        self.config = json.dumps([markdown_extensions, markdown_output_format, markdown.__version__])
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, content):
+        return hashlib.sha256((self.config + '\0' + content).encode()).hexdigest()
+
+    def convert(self, content):
+        if not self.engine:
+            self.engine = markdown.Markdown(extensions=markdown_extensions, output_format=markdown_output_format)
+
+        return self.engine.reset().convert(content)
+
+    def remember(self, key, rendered):
+        self.entries[key] = rendered
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def lookup(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.directory:
+            filename = os.path.join(self.directory, key + '.html')
+
+            try:
+                with open(filename, 'r') as cache_file:
+                    rendered = cache_file.read()
+
+                os.utime(filename)
+            except OSError:
+                pass
+            else:
+                self.remember(key, rendered)
+                return rendered
+
+        return None
+
+    def store(self, key, rendered):
+        self.remember(key, rendered)
+
+        if self.directory:
+            filename = os.path.join(self.directory, key + '.html')
+
+            try:
+                with open(filename + '.tmp', 'w') as cache_file:
+                    cache_file.write(rendered)
+
+                os.replace(filename + '.tmp', filename)
+            except OSError:
+                pass
+
+    def render(self, content):
+        key = self.key(content)
+
+        rendered = self.lookup(key)
+        if rendered is not None:
+            self.hits += 1
+            return rendered
+
+        self.misses += 1
+
+        rendered = self.convert(content)
+        self.store(key, rendered)
+
+        return rendered
+
+    def prerender(self, contents, jobs=1):
+        pending = {}
+        for content in contents:
+            key = self.key(content)
+            if key not in pending and self.lookup(key) is None:
+                pending[key] = content
+
+        # below this a process pool costs more to start than rendering serially saves
+        if jobs <= 1 or len(pending) < jobs * parallel_threshold:
+            return
+
+        self.size = max(self.size, len(self.entries) + len(pending))
+
+        keys = list(pending)
+        chunksize = -(-len(keys) // (jobs * 4))
+        chunks = [keys[start:start + chunksize] for start in range(0, len(keys), chunksize)]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for chunk, rendered_chunk in zip(chunks, executor.map(convert_chunk, [[pending[key] for key in chunk] for chunk in chunks])):
+                for key, rendered in zip(chunk, rendered_chunk):
+                    self.misses += 1
+                    self.store(key, rendered)
+
+    def prune(self):
+        if not self.directory:
+            return
+
+        entries = []
+        total = 0
+
+        with os.scandir(self.directory) as cache_entries:
+            for entry in cache_entries:
+                if not entry.name.endswith('.html'):
+                    continue
+
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+
+        # evict least recently used entries (hits refresh mtime) until under the size budget
+        for _, size, path in sorted(entries):
+            if total <= self.directory_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total -= size
+
+
+render_cache = RenderCache()
+
+
+def convert_chunk(contents):
+    return [render_cache.convert(content) for content in contents]
+
+
 def render(content):
-    return markdown.markdown(content, extensions=['sane_lists', 'smarty', 'pymdownx.extra', 'pymdownx.caret', 'pymdownx.magiclink', 'pymdownx.saneheaders', 'pymdownx.tasklist', 'pymdownx.tilde'], output_format='xhtml')
+    return render_cache.render(content)
+
+
+def prerender(incidents, jobs=1):
+    render_cache.prerender((text for incident in incidents for text in (incident['title'], incident['content'])), jobs)
+
+
+def render_content(incident):
+    # incidents loaded from disk hold on to their rendered content so later pages skip even the cache lookup
+    if isinstance(incident, status.incident.Incident):
+        if incident.html is None:
+            incident.html = render(incident.content)
+
+        return incident.html
+
+    return render(incident['content'])
 
 
 def render_title(title):
@@ -43,79 +217,293 @@ def render_title(title):
     return rendered
 
 
-def generate_html(config, now, services, statuses, incidents, *, template_directory=None):
-    if not template_directory:
-        template_directory = os.path.join(os.path.dirname(__file__), 'html')
+class TemplateSet:
+    fields = {
+        'index': {'title', 'nowtime', 'now', 'services', 'incidents'},
+        'service': {'name', 'title', 'link', 'description', 'status', 'pretty', 'affected', 'uptime'},
+        'incident': {'name', 'title', 'datetime', 'date', 'updatedtime', 'updated', 'status', 'pretty', 'content', 'affected'},
+        'affected': {'services'},
+        'affected_service': {'name', 'title', 'link'},
+        'none': set(),
+        'service_page': {'title', 'nowtime', 'now', 'name', 'service', 'services', 'uptime', 'incidents'},
+        'uptime': {'periods', 'days'},
+        'uptime_period': {'period', 'percent'},
+        'uptime_day': {'date', 'status', 'pretty'},
+        'service_uptime': {'periods', 'days'},
+        'history_page': {'title', 'name', 'month', 'incidents'},
+        'history_index': {'title', 'months'},
+        'history_month': {'name', 'month', 'count'},
+    }
+
+    # templates added after custom template directories were in use fall back to the packaged ones
+    optional = {'service_page', 'uptime', 'uptime_period', 'uptime_day', 'service_uptime', 'history_page', 'history_index', 'history_month'}
+
+    def __init__(self, directory=None):
+        if not directory:
+            directory = os.path.join(os.path.dirname(__file__), 'html')
+
+        self.directory = directory
+        self.formatter = string.Formatter()
+
+        self.templates = {}
+        self.parsed = {}
+
+        for name, fields in self.fields.items():
+            filename = os.path.join(directory, name + '.html')
+            if name in self.optional and not os.path.exists(filename):
+                filename = os.path.join(os.path.dirname(__file__), 'html', name + '.html')
+
+            with open(filename, 'r') as template_file:
+                template = template_file.read()
+
+            if name not in ('index', 'service_page', 'history_page', 'history_index'):
+                template = template.rstrip('\r\n')
+
+            try:
+                parsed = list(self.formatter.parse(template))
+            except ValueError as err:
+                raise ValueError(f'invalid template {name}.html: {err}') from err
+
+            for _, field, _, _ in parsed:
+                if field is not None and re.match(r'^[^.\[]*', field).group(0) not in fields:
+                    raise ValueError(f'invalid template {name}.html: unknown field {{{field}}}')
+
+            self.templates[name] = template
+            self.parsed[name] = parsed
+
+    def format(self, template, /, **values):
+        return self.templates[template].format(**values)
+
+    def render(self, stream, template, /, **values):
+        for literal, field, spec, conversion in self.parsed[template]:
+            if literal:
+                stream.write(literal)
+
+            if field is None:
+                continue
 
-    with open(os.path.join(template_directory, 'index.html'), 'r') as template_file:
-        status_template = template_file.read()
+            value, _ = self.formatter.get_field(field, (), values)
 
-    with open(os.path.join(template_directory, 'service.html'), 'r') as template_file:
-        service_template = template_file.read().rstrip('\r\n')
+            # iterables of rendered fragments are streamed out one at a time
+            if not isinstance(value, str) and hasattr(value, '__iter__') and not spec and not conversion:
+                for index, fragment in enumerate(value):
+                    if index:
+                        stream.write('\n')
+                    stream.write(fragment)
+            else:
+                stream.write(self.formatter.format_field(self.formatter.convert_field(value, conversion), spec))
 
-    with open(os.path.join(template_directory, 'incident.html'), 'r') as template_file:
-        incident_template = template_file.read().rstrip('\r\n')
 
-    with open(os.path.join(template_directory, 'affected.html'), 'r') as template_file:
-        affected_template = template_file.read().rstrip('\r\n')
+def indexed(incidents):
+    if isinstance(incidents, status.incident.IncidentIndex):
+        return incidents
 
-    with open(os.path.join(template_directory, 'affected_service.html'), 'r') as template_file:
-        affected_service_template = template_file.read().rstrip('\r\n')
+    return status.incident.IncidentIndex(incidents)
 
-    with open(os.path.join(template_directory, 'none.html'), 'r') as template_file:
-        none_template = template_file.read().rstrip('\r\n')
 
-    services_html = []
+def render_services(templates, services, statuses, index, uptime=None):
+    empty = True
 
     for service, status in statuses.items():
-        services_html.append(service_template.format(name=html.escape(service), title=html.escape(services[service]['title']), link=html.escape(services[service]['link']), description=html.escape(services[service]['description']), status=html.escape(status), pretty=html.escape(pretty_service_statuses[status]), affected=('affected' if any(service in incident['affected'] for incident in incidents if incident['status'] != 'resolved') else '')))
+        empty = False
+        yield templates.format('service', name=html.escape(service), title=html.escape(services[service]['title']), link=html.escape(services[service]['link']), description=html.escape(services[service]['description']), status=html.escape(status), pretty=html.escape(pretty_service_statuses[status]), affected=('affected' if index.affects(service) else ''), uptime=render_uptime(templates, (uptime or {}).get(service), 'service_uptime', '\n'))
 
-    if not services_html:
-        services_html.append(none_template)
+    if empty:
+        yield templates.format('none')
 
-    incidents_html = []
+
+def render_incidents(templates, services, incidents):
+    empty = True
 
     for incident in incidents:
+        empty = False
+
+        status.metrics.metrics.add('incidents_rendered')
+
         affected_service_html = []
         for service in incident['affected']:
             if service not in services:
                 continue
 
-            affected_service_html.append(affected_service_template.format(name=html.escape(service), title=html.escape(services[service]['title']), link=html.escape(services[service]['link'])))
+            affected_service_html.append(templates.format('affected_service', name=html.escape(service), title=html.escape(services[service]['title']), link=html.escape(services[service]['link'])))
 
         if affected_service_html:
-            affected_html = '\n' + affected_template.format(services='\n'.join(affected_service_html))
+            affected_html = '\n' + templates.format('affected', services='\n'.join(affected_service_html))
         else:
             affected_html = ''
 
-        incidents_html.append(incident_template.format(name=html.escape(incident['name']), title=render_title(incident['title']), datetime=incident['date'].isoformat(timespec='milliseconds'), date=html.escape(incident['date'].strftime('%Y-%m-%d %H:%M %Z')), updatedtime=incident['updated'].isoformat(timespec='milliseconds'), updated=html.escape(incident['updated'].strftime('%Y-%m-%d %H:%M %Z')), status=html.escape(incident['status'] if incident['status'] in pretty_incident_statuses else ''), pretty=html.escape(pretty_incident_statuses.get(incident['status'], incident['status'])), content=render(incident['content']), affected=affected_html))
+        yield templates.format('incident', name=html.escape(incident['name']), title=render_title(incident['title']), datetime=incident['date'].isoformat(timespec='milliseconds'), date=html.escape(incident['date'].strftime('%Y-%m-%d %H:%M %Z')), updatedtime=incident['updated'].isoformat(timespec='milliseconds'), updated=html.escape(incident['updated'].strftime('%Y-%m-%d %H:%M %Z')), status=html.escape(incident['status'] if incident['status'] in pretty_incident_statuses else ''), pretty=html.escape(pretty_incident_statuses.get(incident['status'], incident['status'])), content=render_content(incident), affected=affected_html)
+
+    if empty:
+        yield templates.format('none')
+
+
+def write_html(stream, config, now, services, statuses, incidents, *, templates=None, uptime=None):
+    if not templates:
+        templates = TemplateSet()
+
+    index = indexed(incidents)
 
-    if not incidents_html:
-        incidents_html.append(none_template)
+    templates.render(stream, 'index', title=config['title'], nowtime=now.isoformat(timespec='milliseconds'), now=html.escape(now.strftime('%Y-%m-%d %H:%M %Z')), services=render_services(templates, services, statuses, index, uptime), incidents=render_incidents(templates, services, index))
 
-    return status_template.format(title=config['title'], nowtime=now.isoformat(timespec='milliseconds'), now=html.escape(now.strftime('%Y-%m-%d %H:%M %Z')), services='\n'.join(services_html), incidents='\n'.join(incidents_html))
 
+def render_uptime(templates, uptime, template='uptime', prefix=''):
+    if not uptime:
+        return ''
 
-def generate_json(config, now, services, statuses, incidents):
-    services_json = services.copy()
-    incidents_json = incidents[:]
+    periods = (templates.format('uptime_period', period=html.escape(period[:-1]), percent=(f'{percent:.2f}%' if percent is not None else 'No Data')) for period, percent in uptime.items() if period != 'days')
+    days = (templates.format('uptime_day', date=html.escape(day['date']), status=html.escape(day['status'] or 'none'), pretty=html.escape(pretty_service_statuses[day['status']] if day['status'] else 'No Data')) for day in uptime['days'])
 
-    for info in services_json.values():
-        del info['id']
+    return prefix + templates.format(template, periods='\n'.join(periods), days='\n'.join(days))
 
-    for incident in incidents_json:
-        incident['date'] = incident['date'].isoformat(timespec='milliseconds')
-        incident['updated'] = incident['updated'].isoformat(timespec='milliseconds')
 
-    return json.dumps({'last_updated': now.isoformat(timespec='milliseconds'), 'services': {service: {**info, 'status': statuses[service]} for service, info in services_json.items()}, 'incidents': incidents_json}, indent=2) + '\n'
+def write_service_html(stream, config, now, service, services, statuses, incidents, *, templates=None, uptime=None):
+    if not templates:
+        templates = TemplateSet()
 
+    index = indexed(incidents)
 
-def create_feed(config, now, incidents):
+    templates.render(stream, 'service_page', title=config['title'], nowtime=now.isoformat(timespec='milliseconds'), now=html.escape(now.strftime('%Y-%m-%d %H:%M %Z')), name=html.escape(service), service=html.escape(services[service]['title']), services=render_services(templates, services, {service: statuses[service]}, index), uptime=render_uptime(templates, (uptime or {}).get(service)), incidents=render_incidents(templates, services, index.by_service(service)))
+
+
+def month_title(name):
+    return datetime.datetime.strptime(name, '%Y-%m').strftime('%B %Y')
+
+
+def write_history_html(stream, config, name, services, incidents, *, templates=None):
+    if not templates:
+        templates = TemplateSet()
+
+    templates.render(stream, 'history_page', title=config['title'], name=html.escape(name), month=html.escape(month_title(name)), incidents=render_incidents(templates, services, incidents))
+
+
+def write_history_index_html(stream, config, months, *, templates=None):
+    if not templates:
+        templates = TemplateSet()
+
+    templates.render(stream, 'history_index', title=config['title'], months=(templates.format('history_month', name=html.escape(name), month=html.escape(month_title(name)), count=count) for name, count in months.items()))
+
+
+def generate_html(config, now, services, statuses, incidents, *, template_directory=None, templates=None, uptime=None):
+    if not templates:
+        templates = TemplateSet(template_directory)
+
+    stream = io.StringIO()
+    write_html(stream, config, now, services, statuses, incidents, templates=templates, uptime=uptime)
+
+    return stream.getvalue()
+
+
+class IncidentFields(dict):
+    # iterencode walks anything that is a dict through len() and items() so this stays empty and streams the incident's own fields
+    __slots__ = ('incident',)
+
+    def __init__(self, incident):
+        self.incident = incident
+
+    def __len__(self):
+        return len(self.incident)
+
+    def items(self):
+        return self.incident.items()
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(timespec='milliseconds')
+
+    if isinstance(value, status.incident.Incident):
+        return IncidentFields(value)
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# the encoder reads incidents as they are and formats dates on the way out so nothing is copied or rewritten
+json_encoder = json.JSONEncoder(indent=2, default=json_default)
+
+
+# only these service settings are published, everything else configures how the service is checked
+public_service_keys = ['title', 'link', 'description']
+
+
+def service_json(service, info, status, uptime, stale, tzinfo):
+    service_info = {key: info[key] for key in public_service_keys if key in info}
+    service_info['status'] = status
+
+    if uptime and service in uptime:
+        service_info['uptime'] = uptime[service]
+
+    # statuses served from the last known status cache say when their backend last confirmed them
+    service_info['stale'] = bool(stale and service in stale)
+    if service_info['stale']:
+        service_info['checked'] = datetime.datetime.fromtimestamp(stale[service], tzinfo).isoformat(timespec='milliseconds')
+
+    return service_info
+
+
+def write_json(stream, config, now, services, statuses, incidents, *, uptime=None, stale=None, pages=None):
+    index = indexed(incidents)
+
+    summary = {
+        'last_updated': now,
+        'services': {service: service_json(service, info, statuses[service], uptime, stale, now.tzinfo) for service, info in services.items()},
+        'incidents': index.active,
+        'incident_pages': pages or [],
+    }
+
+    for chunk in json_encoder.iterencode(summary):
+        stream.write(chunk)
+
+    stream.write('\n')
+
+
+def write_json_page(stream, page, incidents, *, prev_page=None, next_page=None):
+    for chunk in json_encoder.iterencode({'page': page, 'prev': prev_page, 'next': next_page, 'incidents': incidents}):
+        stream.write(chunk)
+
+    stream.write('\n')
+
+
+def generate_json(config, now, services, statuses, incidents, *, uptime=None, stale=None, pages=None):
+    stream = io.StringIO()
+    write_json(stream, config, now, services, statuses, incidents, uptime=uptime, stale=stale, pages=pages)
+
+    return stream.getvalue()
+
+
+class FeedHistoryExtension(feedgen.ext.base.BaseExtension):
+    namespace = 'http://purl.org/syndication/history/1.0'
+
+    def extend_ns(self):
+        return {'fh': self.namespace}
+
+    def extend_atom(self, feed):
+        feed.append(feed.makeelement(f'{{{self.namespace}}}archive'))
+
+        return feed
+
+
+def create_feed(config, now, incidents, *, service=None, service_title=None, archive=None, links=None):
     fg = feedgen.feed.FeedGenerator()
 
-    fg.id('incidents')
-    fg.title(config['title'])
-    fg.subtitle(config['title'] + ' - Incidents')
+    if service:
+        fg.id(f'incidents/{service}')
+        fg.title(config['title'] + ' - ' + service_title)
+        fg.subtitle(config['title'] + ' - ' + service_title + ' - Incidents')
+    elif archive:
+        fg.id(f'incidents/archive/{archive}')
+        fg.title(config['title'])
+        fg.subtitle(config['title'] + ' - Incidents - ' + archive)
+    else:
+        fg.id('incidents')
+        fg.title(config['title'])
+        fg.subtitle(config['title'] + ' - Incidents')
+
+    # paging links go first since RSS takes its channel link from the last one
+    for rel, href in (links or {}).items():
+        if href:
+            fg.link(href=href, rel=rel)
+
     fg.link(href='/')
 
     if 'link' in config:
@@ -141,12 +529,29 @@ def create_feed(config, now, incidents):
 
     fg.updated(updated)
 
+    if archive:
+        fg.register_extension('history', FeedHistoryExtension, feedgen.ext.base.BaseEntryExtension, atom=True, rss=False)
+
     return fg
 
 
+def generate_feeds(config, now, incidents, *, prev_archive=None):
+    fg = create_feed(config, now, incidents, links={'prev-archive': prev_archive})
+
+    return fg.atom_str(pretty=True), fg.rss_str(pretty=True)
+
+
 def generate_atom(config, now, incidents):
     return create_feed(config, now, incidents).atom_str(pretty=True)
 
 
 def generate_rss(config, now, incidents):
     return create_feed(config, now, incidents).rss_str(pretty=True)
+
+
+def generate_archive_atom(config, now, archive, incidents, *, current=None, prev_archive=None, next_archive=None):
+    return create_feed(config, now, incidents, archive=archive, links={'current': current, 'prev-archive': prev_archive, 'next-archive': next_archive}).atom_str(pretty=True)
+
+
+def generate_service_atom(config, now, service, services, incidents):
+    return create_feed(config, now, indexed(incidents).by_service(service), service=service, service_title=services[service]['title']).atom_str(pretty=True)
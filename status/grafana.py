@@ -1,9 +1,15 @@
+import concurrent.futures
 import json
+import os
+import threading
+import time
 
 import httpx
 
+import status.metrics
 
-__all__ = ['check']
+
+__all__ = ['CircuitBreaker', 'check', 'poll']
 
 
 status_map = {
@@ -24,13 +30,129 @@ class BearerAuth(httpx.Auth):
         yield request
 
 
-def check(api_base, api_key, services):
-    statuses = {}
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, *, threshold=5, backoff=300.0, failures=0, open_until=0.0):
+        self.threshold = threshold
+        self.backoff = backoff
+
+        self.failures = failures
+        self.open_until = open_until
+
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # once the backoff runs out requests are let through again and the next failure reopens it straight away
+        return time.time() >= self.open_until
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                return
+
+            self.failures += 1
+
+            if self.threshold and self.failures >= self.threshold:
+                self.open_until = time.time() + self.backoff
+
+    def state(self):
+        return {'failures': self.failures, 'open_until': self.open_until}
+
+
+def request(client, url, breaker):
+    if breaker and not breaker.allow():
+        raise CircuitOpenError(f'not requesting {url} while Grafana is backing off')
+
+    try:
+        response = client.get(url)
+    except httpx.TransportError:
+        if breaker:
+            breaker.record(False)
+        raise
+
+    # only an unreachable or failing Grafana counts against the breaker and not an unknown alert
+    if breaker:
+        breaker.record(not response.is_server_error)
+
+    return response
+
+
+def fetch(client, api_base, alert_id, services=(), breaker=None):
+    start = time.perf_counter()
+
+    try:
+        return status_map[request(client, f'{api_base}/alerts/{alert_id}', breaker).json()['State']]
+    except (httpx.HTTPError, json.JSONDecodeError, KeyError) as err:
+        status.metrics.metrics.add('grafana_errors_total', type=type(err).__name__)
+        return None
+    finally:
+        elapsed = time.perf_counter() - start
 
-    for service, info in services.items():
-        try:
-            statuses[service] = status_map[httpx.get(f'{api_base}/alerts/{info["id"]}', auth=BearerAuth(api_key)).json()['State']]
-        except (httpx.HTTPError, json.JSONDecodeError, KeyError):
-            statuses[service] = 'unknown'
+        # every service sharing the alert waited on the same request
+        for service in services:
+            status.metrics.metrics.set('grafana_request_duration_seconds', elapsed, service=service)
+
+
+def fetch_all(client, api_base, breaker=None):
+    try:
+        return {str(alert['id']): status_map[alert['state']] for alert in request(client, f'{api_base}/alerts', breaker).json() if alert.get('state') in status_map}
+    except (httpx.HTTPError, json.JSONDecodeError, KeyError, TypeError) as err:
+        status.metrics.metrics.add('grafana_errors_total', type=type(err).__name__)
+        return {}
+
+
+def check(api_base, api_key, services, *, concurrency=8, timeout=10.0, deadline=None, bulk=False, breaker=None, failed='unknown'):
+    start = time.monotonic()
+
+    statuses = {service: failed for service in services}
+
+    if breaker and not breaker.allow():
+        status.metrics.metrics.add('grafana_errors_total', len(services), type=CircuitOpenError.__name__)
+        return statuses
+
+    client = httpx.Client(auth=BearerAuth(api_key), timeout=timeout, limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    # a service without an alert id has nothing to look up so it is left failed
+    remaining = {service: info for service, info in services.items() if info.get('id')}
+
+    if bulk:
+        alerts = fetch_all(client, api_base, breaker)
+
+        for service, info in list(remaining.items()):
+            if str(info['id']) in alerts:
+                statuses[service] = alerts[str(info['id'])]
+                del remaining[service]
+
+    # services sharing an alert are looked up with a single request
+    alert_services = {}
+    for service, info in remaining.items():
+        alert_services.setdefault(str(info['id']), []).append(service)
+
+    futures = {executor.submit(fetch, client, api_base, alert_id, names, breaker): alert_id for alert_id, names in alert_services.items()}
+
+    # the deadline covers the whole check including the bulk listing
+    done, pending = concurrent.futures.wait(futures, timeout=(max(deadline - (time.monotonic() - start), 0) if deadline is not None else None))
+
+    for future in done:
+        if future.result() is not None:
+            for service in alert_services[futures[future]]:
+                statuses[service] = future.result()
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    if pending:
+        # requests still in flight are bounded by the per-request timeout so close the client once they give up
+        threading.Thread(target=(lambda: (executor.shutdown(wait=True), client.close())), daemon=True).start()
+    else:
+        client.close()
 
     return statuses
+
+
+def poll(gconfig, services, *, breaker=None):
+    return check(os.environ.get('GRAFANA_API_BASE') or gconfig['api_base'], os.environ.get('GRAFANA_API_KEY') or gconfig['api_key'], services, concurrency=gconfig.getint('concurrency', 8), timeout=gconfig.getfloat('timeout', 10.0), deadline=gconfig.getfloat('deadline', None), bulk=gconfig.getboolean('bulk', False), breaker=breaker, failed=None)
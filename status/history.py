@@ -0,0 +1,155 @@
+import datetime
+import json
+import os
+import os.path
+import struct
+
+
+__all__ = ['record', 'uptime']
+
+
+services_filename = 'services.json'
+
+# (unix time, service number, status code) with a pad byte so records stay 8 byte aligned
+record_format = struct.Struct('<IHBx')
+
+status_codes = {
+    'up': 0,
+    'maintenance': 1,
+    'degraded': 2,
+    'down': 3,
+    'unknown': 4,
+}
+
+code_statuses = {code: status for status, code in status_codes.items()}
+
+record_fields = [('time', '<u4'), ('service', '<u2'), ('status', 'u1'), ('pad', 'V1')]
+
+
+def get_filename(directory, when):
+    return os.path.join(directory, when.astimezone(datetime.timezone.utc).strftime('%Y-%m') + '.log')
+
+
+def load_services(directory):
+    try:
+        with open(os.path.join(directory, services_filename), 'r') as services_file:
+            return json.load(services_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_services(directory, numbers):
+    filename = os.path.join(directory, services_filename)
+
+    with open(filename + '.tmp', 'w') as services_file:
+        json.dump(numbers, services_file, indent=2)
+        services_file.write('\n')
+
+    os.replace(filename + '.tmp', filename)
+
+
+def record(directory, now, statuses):
+    os.makedirs(directory, exist_ok=True)
+
+    numbers = load_services(directory)
+
+    if any(service not in numbers for service in statuses):
+        for service in statuses:
+            numbers.setdefault(service, len(numbers))
+
+        save_services(directory, numbers)
+
+    timestamp = int(now.timestamp())
+    data = b''.join(record_format.pack(timestamp, numbers[service], status_codes.get(status, status_codes['unknown'])) for service, status in statuses.items())
+
+    # a single append keeps the records from one run together even if two runs overlap
+    with open(get_filename(directory, now), 'ab') as history_file:
+        history_file.write(data)
+
+
+def load(directory, start, end):
+    import numpy
+
+    record_dtype = numpy.dtype(record_fields)
+
+    month = start.astimezone(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    while month <= end:
+        filename = get_filename(directory, month)
+
+        try:
+            # a partial record from an interrupted append is left off the end
+            count = os.stat(filename).st_size // record_format.size
+        except FileNotFoundError:
+            count = 0
+
+        if count:
+            yield numpy.memmap(filename, dtype=record_dtype, mode='r', shape=(count,))
+
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def uptime(directory, services, now, *, periods=(30, 90), days=90):
+    # numpy is only needed here so recording history and the other subcommands do not pay to import it
+    import numpy
+
+    numbers = load_services(directory)
+    count = len(numbers)
+
+    days = max(days, *periods)
+    slots = len(status_codes)
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - datetime.timedelta(days=(days - 1))
+
+    # midnights come from wall clock dates so days stay aligned across daylight saving changes
+    dates = [first_day + datetime.timedelta(days=day) for day in range(days)]
+    boundaries = [int(date.timestamp()) for date in dates] + [int(now.timestamp()) + 1]
+
+    totals = numpy.zeros((days, count * slots), dtype=numpy.int64)
+
+    for records in load(directory, first_day, now):
+        # records are appended in time order so every day is a contiguous run that can be found by bisection
+        offsets = numpy.searchsorted(records['time'], boundaries)
+        if offsets[0] == offsets[-1]:
+            continue
+
+        records = records[offsets[0]:offsets[-1]]
+        offsets -= offsets[0]
+
+        cell = records['service'].astype(numpy.intp)
+        cell *= slots
+        cell += numpy.minimum(records['status'], status_codes['unknown'])
+
+        for day in range(days):
+            if offsets[day] < offsets[day + 1]:
+                totals[day] += numpy.bincount(cell[offsets[day]:offsets[day + 1]], minlength=count * slots)[:count * slots]
+
+    totals = totals.reshape(days, count, slots).transpose(1, 0, 2)
+
+    seen = totals[:, :, :status_codes['unknown']] > 0
+    known = totals[:, :, :status_codes['unknown']].sum(axis=2)
+    available = known - totals[:, :, status_codes['down']]
+
+    # codes rise with severity so the worst status of each day is the highest code seen
+    worst = numpy.where(seen.any(axis=2), status_codes['unknown'] - 1 - seen[:, :, ::-1].argmax(axis=2), -1)
+
+    result = {}
+
+    for service in services:
+        if service not in numbers:
+            continue
+
+        number = numbers[service]
+
+        result[service] = {}
+
+        for period in periods:
+            period_known = int(known[number, -period:].sum())
+            period_available = int(available[number, -period:].sum())
+
+            result[service][f'{period}d'] = round(100 * period_available / period_known, 3) if period_known else None
+
+        result[service]['days'] = [{'date': date.date().isoformat(), 'status': code_statuses[int(code)] if code >= 0 else None} for date, code in zip(dates, worst[number])]
+
+    return result
@@ -1,14 +1,151 @@
+import bisect
+import collections.abc
 import datetime
+import json
 import os
 import os.path
 import re
+import sys
 import textwrap
 
 import dateutil.parser
 import dateutil.tz
 
+import status.metrics
 
-__all__ = ['get_filename', 'get_all', 'get', 'create', 'modify']
+
+__all__ = ['Incident', 'IncidentIndex', 'get_filename', 'get_all', 'get', 'load_content', 'create', 'modify', 'batch']
+
+
+index_filename = '.index.json'
+index_version = 2
+
+statuses = ['notice', 'resolved', 'outage', 'partial', 'monitoring', 'planned', 'maintenance', 'unknown']
+closed_statuses = {'notice', 'resolved'}
+
+
+class Incident(collections.abc.Mapping):
+    __slots__ = ('name', 'title', 'date', 'updated', 'status', 'affected', 'filename', 'text', 'requested', 'html')
+
+    fields = ('name', 'title', 'date', 'updated', 'status', 'affected')
+
+    def __init__(self, name, title, date, updated, status, affected, content=None, *, filename=None):
+        self.name = name
+        self.title = title
+        self.date = date
+        self.updated = updated
+        # statuses and service names repeat across every incident so they share one string each
+        self.status = sys.intern(status)
+        self.affected = tuple(sys.intern(service) for service in affected)
+        self.filename = filename
+        self.text = content
+        self.requested = False
+        self.html = None
+
+    @property
+    def content(self):
+        if self.text is None and self.requested and self.filename:
+            with open(self.filename, 'r') as incident_file:
+                extract_title(incident_file)
+                extract_date(incident_file, 'Date')
+                extract_date(incident_file, 'Updated')
+                extract_status(incident_file)
+                extract_affected(incident_file)
+
+                self.text = extract_content(incident_file)
+
+        return self.text
+
+    def keys(self):
+        # content is part of the mapping once it is loaded or has been asked for with load_content
+        if self.text is None and not self.requested:
+            return self.fields
+
+        return self.fields + ('content',)
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key == 'content':
+            self.text = value
+            self.html = None
+        elif key == 'status':
+            self.status = sys.intern(value)
+        elif key == 'affected':
+            self.affected = tuple(sys.intern(service) for service in value)
+        elif key in self.fields:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f'Incident({self.name!r})'
+
+
+class IncidentIndex:
+    def __init__(self, incidents):
+        self.incidents = list(incidents)
+
+        self.services = {}
+        self.statuses = {}
+        self.unresolved = set()
+        self.active = []
+
+        for incident in self.incidents:
+            for service in dict.fromkeys(incident['affected']):
+                self.services.setdefault(service, []).append(incident)
+
+                if incident['status'] != 'resolved':
+                    self.unresolved.add(service)
+
+            self.statuses.setdefault(incident['status'], []).append(incident)
+
+            if incident['status'] not in closed_statuses:
+                self.active.append(incident)
+
+        # incidents come newest first so sorting them reversed keeps ties in the same order when read backwards
+        self.chronological = sorted(reversed(self.incidents), key=(lambda incident: incident['date']))
+        self.dates = [incident['date'] for incident in self.chronological]
+
+    def __len__(self):
+        return len(self.incidents)
+
+    def __iter__(self):
+        return iter(self.incidents)
+
+    def __reversed__(self):
+        return reversed(self.incidents)
+
+    def __getitem__(self, key):
+        return self.incidents[key]
+
+    def by_service(self, service):
+        return self.services.get(service, [])
+
+    def by_status(self, status):
+        return self.statuses.get(status, [])
+
+    def by_date(self, start=None, end=None):
+        lower = bisect.bisect_left(self.dates, start) if start else 0
+        upper = bisect.bisect_left(self.dates, end) if end else len(self.dates)
+
+        return self.chronological[lower:upper][::-1]
+
+    def affects(self, service):
+        return service in self.unresolved
 
 
 def slugify(text):
@@ -118,82 +255,231 @@ def extract_content(incident_file):
     return incident_file.read().strip()
 
 
-def make_name(directory, date, title):
+def make_name(directory, date, title, *, partitioned=False, taken=None):
+    def exists(name):
+        if taken is not None:
+            return name in taken
+
+        return os.path.exists(get_filename(directory, name, partitioned=partitioned))
+
     name = date.strftime('%Y-%m-%d') + '-' + slugify(title)
 
     num = 0
-    while os.path.exists(os.path.join(directory, name + '.md')):
+    while exists(name):
         num += 1
         name = date.strftime('%Y-%m-%d') + '-' + slugify(title) + '-' + str(num)
 
     return name
 
 
-def get_filename(directory, name):
-    return os.path.join(directory, name + '.md')
+def get_partition(name):
+    match = re.match(r'^([0-9]{4})-([0-9]{2})-', name)
+    if not match:
+        return None
+
+    return os.path.join(*match.groups())
+
+
+def get_filename(directory, name, *, partitioned=False):
+    partition = get_partition(name) if partitioned else None
+
+    if partition:
+        filename = os.path.join(directory, partition, name + '.md')
+
+        # fall back to incidents still in the flat layout
+        if not os.path.exists(filename) and os.path.exists(os.path.join(directory, name + '.md')):
+            return os.path.join(directory, name + '.md')
+
+        return filename
+    else:
+        return os.path.join(directory, name + '.md')
+
+
+def load_index(directory):
+    try:
+        with open(os.path.join(directory, index_filename), 'r') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return {}, {}
+
+    if not isinstance(index, dict) or index.get('version') != index_version:
+        return {}, {}
+
+    return index.get('incidents', {}), index.get('directories', {})
+
+
+def save_index(directory, index, directories):
+    filename = os.path.join(directory, index_filename)
+
+    try:
+        with open(filename + '.tmp', 'w') as index_file:
+            json.dump({'version': index_version, 'incidents': index, 'directories': directories}, index_file, separators=(',', ':'))
+
+        os.replace(filename + '.tmp', filename)
+    except OSError:
+        pass
+
+
+def serialize(incident):
+    return {**incident, 'date': incident['date'].isoformat(), 'updated': incident['updated'].isoformat(), 'affected': list(incident['affected'])}
+
+
+def deserialize(entry, filename, timezone=None):
+    return Incident(entry['name'], entry['title'], dateutil.parser.isoparse(entry['date']).astimezone(dateutil.tz.gettz(timezone)), dateutil.parser.isoparse(entry['updated']).astimezone(dateutil.tz.gettz(timezone)), entry['status'], entry['affected'], entry.get('content'), filename=filename)
+
+
+def scan(directory, prefix, index, new_index, timezone=None, content=True):
+    incidents = []
+
+    with os.scandir(os.path.join(directory, prefix)) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.md') or not entry.is_file():
+                continue
 
+            key = prefix + entry.name
 
-def get_all(directory, timezone=None):
-    return sorted([get(directory, filename[:-3], timezone) for filename in os.listdir(directory) if filename.endswith('.md')], key=(lambda incident: incident['date']), reverse=True)
+            stat = entry.stat()
+            stat_key = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
 
+            cached = index.get(key)
+            if cached and cached['stat'] == stat_key and (not content or 'content' in cached['incident']):
+                # index entries are keyed by their path relative to the incident directory
+                incident = deserialize(cached['incident'], entry.path, timezone)
+                new_index[key] = cached
+            else:
+                incident = read(entry.path, entry.name[:-3], timezone, content)
+                status.metrics.metrics.add('incidents_parsed')
+                new_index[key] = {'stat': stat_key, 'incident': serialize(incident)}
 
-def get(directory, name, timezone=None):
-    with open(os.path.join(directory, name + '.md'), 'r') as incident_file:
-        title = extract_title(incident_file)
-        date = extract_date(incident_file, 'Date', timezone)
-        updated = extract_date(incident_file, 'Updated', timezone)
-        status = extract_status(incident_file)
-        affected = extract_affected(incident_file)
-        content = extract_content(incident_file)
+            incidents.append(incident)
 
-    return {
-        'name': name,
-        'title': title,
-        'date': date,
-        'updated': updated,
-        'status': status,
-        'affected': affected,
-        'content': content,
-    }
+    return incidents
 
 
-def rename(directory, name):
-    incident = get(directory, name)
-    new_name = make_name(directory, incident['date'], incident['title'])
+def get_all(directory, timezone=None, *, content=True, partitioned=False, since=None, rebuild_index=False):
+    index, directories = ({}, {}) if rebuild_index else load_index(directory)
+    new_index = {}
+    new_directories = {}
+
+    incidents = scan(directory, '', index, new_index, timezone, content)
+
+    if partitioned:
+        for year in sorted(os.listdir(directory)):
+            if not re.match('^[0-9]{4}$', year) or not os.path.isdir(os.path.join(directory, year)):
+                continue
+
+            for month in sorted(os.listdir(os.path.join(directory, year))):
+                if not re.match('^[0-9]{2}$', month):
+                    continue
+
+                partition = year + '/' + month
+                partition_directory = os.path.join(directory, year, month)
+
+                if not os.path.isdir(partition_directory):
+                    continue
+
+                mtime = os.stat(partition_directory).st_mtime_ns
+
+                # a month holding only closed incidents last updated before the retention window does not need to be listed
+                cached = directories.get(partition)
+                if since and cached and cached['stat'] == mtime and cached['closed'] and (not cached['updated'] or dateutil.parser.isoparse(cached['updated']) < since):
+                    new_directories[partition] = cached
+                    new_index.update((key, entry) for key, entry in index.items() if key.startswith(partition + '/'))
+                    continue
+
+                partition_incidents = scan(directory, partition + '/', index, new_index, timezone, content)
+                latest = max((incident['updated'] for incident in partition_incidents), default=None)
+
+                new_directories[partition] = {
+                    'stat': mtime,
+                    'closed': all(incident['status'] in closed_statuses for incident in partition_incidents),
+                    'updated': latest.isoformat() if latest else None,
+                }
+
+                incidents.extend(partition_incidents)
+
+    if new_index != index or new_directories != directories:
+        save_index(directory, new_index, new_directories)
+
+    return sorted(incidents, key=(lambda incident: incident['date']), reverse=True)
+
+
+def read(filename, name, timezone=None, content=True):
+    with open(filename, 'r') as incident_file:
+        return Incident(name, extract_title(incident_file), extract_date(incident_file, 'Date', timezone), extract_date(incident_file, 'Updated', timezone), extract_status(incident_file), extract_affected(incident_file), extract_content(incident_file) if content else None, filename=filename)
+
+
+def get(directory, name, timezone=None, *, content=True, partitioned=False):
+    return read(get_filename(directory, name, partitioned=partitioned), name, timezone, content)
+
+
+def load_content(directory, incident, *, partitioned=False):
+    if isinstance(incident, Incident):
+        # the file is only read when the content is first used
+        if 'content' not in incident:
+            if not incident.filename:
+                incident.filename = get_filename(directory, incident.name, partitioned=partitioned)
+
+            incident.requested = True
+    elif 'content' not in incident:
+        incident['content'] = get(directory, incident['name'], partitioned=partitioned)['content']
+
+    return incident
+
+
+def format_incident(date, title, updated, status, affected, content):
+    date_formatted = date.isoformat(timespec='minutes')
+    updated_formatted = updated.isoformat(timespec='minutes')
+    affected_formatted = '\nAffected:\n' + ''.join(f'* {service}\n' for service in affected) if affected else ''
+
+    return textwrap.dedent(f'''
+    # {title}
+
+    Date: {date_formatted}
+    Updated: {updated_formatted}
+    Status: {status}
+    ''').lstrip() + affected_formatted + '\n' + content + '\n'
+
+
+def write(filename, text):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    with open(filename + '.tmp', 'w') as incident_file:
+        incident_file.write(text)
+
+    os.replace(filename + '.tmp', filename)
+
+
+def rename(directory, name, *, partitioned=False):
+    incident = get(directory, name, partitioned=partitioned)
+    new_name = make_name(directory, incident['date'], incident['title'], partitioned=partitioned)
 
     if name != new_name:
-        os.rename(os.path.join(directory, name + '.md'), os.path.join(directory, new_name + '.md'))
+        new_filename = get_filename(directory, new_name, partitioned=partitioned)
+
+        os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+        os.rename(get_filename(directory, name, partitioned=partitioned), new_filename)
 
     return new_name
 
 
-def create(directory, *, name=None, date=None, title='', updated=None, status='notice', affected=None, content='', timezone=None):
+def create(directory, *, name=None, date=None, title='', updated=None, status='notice', affected=None, content='', timezone=None, partitioned=False):
     if not date:
         date = datetime.datetime.now().astimezone(dateutil.tz.gettz(timezone))
     if not updated:
         updated = datetime.datetime.now().astimezone(dateutil.tz.gettz(timezone))
 
     if not name:
-        name = make_name(directory, date, title)
-
-    date_formatted = date.isoformat(timespec='minutes')
-    updated_formatted = updated.isoformat(timespec='minutes')
-    affected_formatted = '\nAffected:\n' + ''.join(f'* {service}\n' for service in affected) if affected else ''
+        name = make_name(directory, date, title, partitioned=partitioned)
 
-    with open(os.path.join(directory, name + '.md'), 'w') as incident_file:
-        incident_file.write(textwrap.dedent(f'''
-        # {title}
-
-        Date: {date_formatted}
-        Updated: {updated_formatted}
-        Status: {status}
-        ''').lstrip() + affected_formatted + '\n' + content + '\n')
+    # written through a rename so partitioned month directories see a new mtime
+    write(get_filename(directory, name, partitioned=partitioned), format_incident(date, title, updated, status, affected, content))
 
     return name
 
 
-def modify(directory, name, *, date=None, title=None, updated=None, status=None, affected=None, content='', timezone=None):
-    incident = get(directory, name)
+def modify(directory, name, *, date=None, title=None, updated=None, status=None, affected=None, content='', timezone=None, partitioned=False):
+    incident = get(directory, name, partitioned=partitioned)
 
     if not date:
         date = incident['date']
@@ -206,4 +492,117 @@ def modify(directory, name, *, date=None, title=None, updated=None, status=None,
     if not affected:
         affected = incident['affected']
 
-    return create(directory, name=incident['name'], date=date, title=title, updated=updated, status=status, affected=affected, content=(incident['content'] + ('\n\n' + content.strip() if content.strip() else '')), timezone=None)
+    return create(directory, name=incident['name'], date=date, title=title, updated=updated, status=status, affected=affected, content=(incident['content'] + ('\n\n' + content.strip() if content.strip() else '')), timezone=None, partitioned=partitioned)
+
+
+def parse_date(value, timezone=None):
+    return dateutil.parser.isoparse(value).astimezone(dateutil.tz.gettz(timezone)) if value else None
+
+
+def batch(directory, operations, *, timezone=None, partitioned=False):
+    now = datetime.datetime.now().astimezone(dateutil.tz.gettz(timezone))
+
+    # one scan of the directory names every incident so collisions and lookups are resolved in memory
+    incidents = {incident['name']: incident for incident in get_all(directory, timezone, content=False, partitioned=partitioned)}
+    taken = set(incidents)
+    filenames = {name: incident.filename for name, incident in incidents.items()}
+
+    changes = {}
+    summary = []
+
+    for number, operation in enumerate(operations, 1):
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError('operation must be an object')
+
+            for field in ('op', 'name', 'service', 'title', 'status', 'content'):
+                if operation.get(field) is not None and not isinstance(operation[field], str):
+                    raise ValueError(f'{field} must be a string')
+
+            # a single service given as a string would otherwise be written out one character per line
+            if operation.get('affected') is not None and not (isinstance(operation['affected'], list) and all(isinstance(service, str) for service in operation['affected'])):
+                raise ValueError('affected must be a list of strings')
+
+            action = operation.get('op')
+            if action not in ('create', 'edit', 'resolve'):
+                raise ValueError(f'unknown op {action!r}')
+
+            if operation.get('status') and operation['status'] not in statuses:
+                raise ValueError(f'unknown status {operation["status"]!r}')
+
+            date = parse_date(operation.get('date'), timezone)
+            updated = parse_date(operation.get('updated'), timezone)
+            content = operation.get('content') or ''
+
+            if action == 'create':
+                title = operation.get('title') or ''
+                name = operation.get('name') or make_name(directory, date or now, title, partitioned=partitioned, taken=taken)
+
+                if name in taken:
+                    raise ValueError(f'incident {name} already exists')
+
+                taken.add(name)
+
+                incident = {'name': name, 'title': title, 'date': date or now, 'updated': updated or now, 'status': operation.get('status') or 'notice', 'affected': operation.get('affected') or [], 'content': content}
+
+                incidents[name] = changes[name] = incident
+                summary.append(('created', name, None, incident['status']))
+
+                continue
+
+            if operation.get('name'):
+                if operation['name'] not in incidents:
+                    raise ValueError(f'no incident named {operation["name"]}')
+
+                targets = [incidents[operation['name']]]
+            elif operation.get('service'):
+                targets = [incident for incident in incidents.values() if operation['service'] in incident['affected'] and incident['status'] not in closed_statuses]
+            else:
+                raise ValueError(f'{action} needs a name or a service')
+        except (ValueError, TypeError) as err:
+            raise ValueError(f'operation {number}: {err}') from err
+
+        for incident in targets:
+            load_content(directory, incident, partitioned=partitioned)
+
+            new_status = 'resolved' if action == 'resolve' else (operation.get('status') or incident['status'])
+
+            new_incident = {
+                'name': incident['name'],
+                'title': operation.get('title') or incident['title'],
+                'date': date or incident['date'],
+                'updated': updated or now,
+                'status': new_status,
+                'affected': operation.get('affected') or incident['affected'],
+                'content': incident['content'] + ('\n\n' + content.strip() if content.strip() else ''),
+            }
+
+            incidents[incident['name']] = changes[incident['name']] = new_incident
+            summary.append(('updated', incident['name'], incident['status'], new_status))
+
+    # every file is staged before any is moved into place so a failure part way leaves the directory as it was
+    staged = []
+
+    try:
+        for name, incident in changes.items():
+            # edited incidents are rewritten where they were found rather than where their name would put them
+            filename = filenames.get(name) or get_filename(directory, name, partitioned=partitioned)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+            staged.append(filename)
+
+            with open(filename + '.tmp', 'w') as incident_file:
+                incident_file.write(format_incident(incident['date'], incident['title'], incident['updated'], incident['status'], incident['affected'], incident['content']))
+    except BaseException:
+        for filename in staged:
+            try:
+                os.remove(filename + '.tmp')
+            except FileNotFoundError:
+                pass
+
+        raise
+
+    for filename in staged:
+        os.replace(filename + '.tmp', filename)
+
+    return summary
@@ -0,0 +1,100 @@
+import contextlib
+import os
+import os.path
+import threading
+import time
+
+
+__all__ = ['Metrics', 'NullMetrics', 'metrics']
+
+
+descriptions = {
+    'stage_duration_seconds': 'Duration of each stage of the last run in seconds.',
+    'grafana_request_duration_seconds': 'Duration of the last Grafana alert request for each service in seconds.',
+    'grafana_errors_total': 'Grafana request errors during the last run by exception type.',
+    'probe_duration_seconds': 'Duration of the last http or tcp probe for each service in seconds.',
+    'probe_errors_total': 'Failed http or tcp probes during the last run by exception type.',
+    'incidents_parsed': 'Incident files parsed (not served from the incident index) during the last run.',
+    'incidents_filtered': 'Incidents dropped by the retention window during the last run.',
+    'incidents_rendered': 'Incidents rendered into HTML pages during the last run.',
+    'render_cache_hits': 'Markdown render cache hits during the last run.',
+    'render_cache_misses': 'Markdown render cache misses during the last run.',
+    'output_bytes': 'Size of each output file written during the last run in bytes.',
+    'last_run_timestamp_seconds': 'Unix time the last run finished.',
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add('stage_duration_seconds', time.perf_counter() - start, stage=name)
+
+    def set(self, metric, value, **labels):
+        with self.lock:
+            self.values.setdefault(metric, {})[tuple(sorted(labels.items()))] = value
+
+    def add(self, metric, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+
+        with self.lock:
+            series = self.values.setdefault(metric, {})
+            series[key] = series.get(key, 0) + value
+
+    def format(self, prefix='status_'):
+        lines = []
+
+        with self.lock:
+            for metric, series in self.values.items():
+                name = prefix + metric
+
+                if metric in descriptions:
+                    lines.append(f'# HELP {name} {descriptions[metric]}')
+                lines.append(f'# TYPE {name} gauge')
+
+                for labels, value in series.items():
+                    label_text = ','.join(f'{label}="{escape(label_value)}"' for label, label_value in labels)
+                    lines.append(f'{name}{{{label_text}}} {value!r}' if label_text else f'{name} {value!r}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        self.set('last_run_timestamp_seconds', time.time())
+
+        # node_exporter may read the file at any moment so it is swapped in whole
+        with open(filename + '.tmp', 'w') as metrics_file:
+            metrics_file.write(self.format())
+
+        os.replace(filename + '.tmp', filename)
+
+    def report(self, stream):
+        for (labels, duration) in self.values.get('stage_duration_seconds', {}).items():
+            stream.write(f'{dict(labels)["stage"]:16} {duration:8.3f}s\n')
+
+
+class NullMetrics:
+    nullcontext = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self.nullcontext
+
+    def set(self, metric, value, **labels):
+        pass
+
+    def add(self, metric, value=1, **labels):
+        pass
+
+
+metrics = NullMetrics()
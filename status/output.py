@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import os.path
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import status.metrics
+
+
+__all__ = ['compressors', 'Output', 'write']
+
+
+def compress_gzip(source, destination):
+    with gzip.GzipFile(filename='', mode='wb', fileobj=destination, compresslevel=9, mtime=0) as compressed:
+        shutil.copyfileobj(source, compressed)
+
+
+def compress_brotli(source, destination):
+    compressor = brotli.Compressor(quality=11)
+
+    for chunk in iter(lambda: source.read(65536), b''):
+        destination.write(compressor.process(chunk))
+
+    destination.write(compressor.finish())
+
+
+compressors = {
+    'gzip': ('gz', compress_gzip),
+}
+
+if brotli:
+    compressors['brotli'] = ('br', compress_brotli)
+
+
+def digest(filename):
+    file_hash = hashlib.sha256()
+
+    with open(filename, 'rb') as existing_file:
+        for chunk in iter(lambda: existing_file.read(65536), b''):
+            file_hash.update(chunk)
+
+    return file_hash.digest()
+
+
+class Output:
+    def __init__(self, filename, *, compress=()):
+        self.filename = filename
+        self.compress = compress
+
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.file = None
+        self.changed = None
+
+    def __enter__(self):
+        self.file = open(self.filename + '.tmp', 'wb')
+
+        return self
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.hash.update(data)
+        self.size += len(data)
+
+        self.file.write(data)
+
+    def unchanged(self):
+        try:
+            if os.stat(self.filename).st_size != self.size:
+                return False
+
+            return digest(self.filename) == self.hash.digest()
+        except OSError:
+            return False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+        if exc_type:
+            os.remove(self.filename + '.tmp')
+            return
+
+        status.metrics.metrics.set('output_bytes', self.size, file=self.filename)
+
+        # leaving unchanged files alone keeps their mtime for conditional requests and caches
+        self.changed = not self.unchanged()
+        if self.changed:
+            os.replace(self.filename + '.tmp', self.filename)
+        else:
+            os.remove(self.filename + '.tmp')
+
+        for name in self.compress:
+            extension, compressor = compressors[name]
+            compressed_filename = self.filename + '.' + extension
+
+            if self.changed or not os.path.exists(compressed_filename):
+                with open(self.filename, 'rb') as source, open(compressed_filename + '.tmp', 'wb') as destination:
+                    compressor(source, destination)
+
+                os.replace(compressed_filename + '.tmp', compressed_filename)
+
+                stat = os.stat(self.filename)
+                os.utime(compressed_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def write(filename, data, *, compress=()):
+    with Output(filename, compress=compress) as output:
+        output.write(data)
+
+    return output.changed
@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import time
+import urllib.parse
+
+import status.metrics
+
+
+__all__ = ['check', 'poll']
+
+
+async def close(writer):
+    writer.close()
+
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+async def probe_http(info):
+    url = urllib.parse.urlsplit(info['url'])
+    https = url.scheme == 'https'
+
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or (443 if https else 80), ssl=(https or None))
+
+    try:
+        target = (url.path or '/') + ('?' + url.query if url.query else '')
+
+        host = f'[{url.hostname}]' if ':' in url.hostname else url.hostname
+        if url.port:
+            host += f':{url.port}'
+
+        # credentials in the url are sent as basic auth rather than leaking into the Host header
+        authorization = ''
+        if url.username is not None:
+            credentials = urllib.parse.unquote(url.username) + ':' + urllib.parse.unquote(url.password or '')
+            authorization = 'Authorization: Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii') + '\r\n'
+
+        # only the status line matters so a one-shot request avoids any client connection pool
+        writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\n{authorization}User-Agent: status\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+
+        version, code = (await reader.readline()).split(None, 2)[:2]
+    finally:
+        await close(writer)
+
+    if not version.startswith(b'HTTP/'):
+        raise ValueError(f'not an HTTP response from {info["url"]}')
+
+    if 'expect_status' in info:
+        return int(code) == int(info['expect_status'])
+
+    return int(code) < 400
+
+
+async def probe_tcp(info):
+    _, writer = await asyncio.open_connection(info['host'], int(info['port']))
+
+    await close(writer)
+
+    return True
+
+
+def validate(info, degraded_after):
+    if info.get('backend') == 'tcp':
+        if not info.get('host'):
+            raise ValueError('tcp probes need a host')
+
+        int(info['port'])
+    else:
+        url = urllib.parse.urlsplit(info['url'])
+
+        # a url without a scheme parses without a hostname and would probe localhost
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError(f'not an http or https url: {info["url"]}')
+
+        # reading the port raises for one that is not a number or out of range
+        url.port
+
+    return float(info['degraded_after']) if 'degraded_after' in info else degraded_after
+
+
+async def probe(semaphore, service, info, timeout, degraded_after):
+    try:
+        threshold = validate(info, degraded_after)
+    except (KeyError, ValueError):
+        # a misconfigured service is left unknown on its own instead of failing the whole poll
+        status.metrics.metrics.add('probe_errors_total', type='config')
+        return None
+
+    async with semaphore:
+        start = time.perf_counter()
+
+        try:
+            reachable = await asyncio.wait_for(probe_tcp(info) if info.get('backend') == 'tcp' else probe_http(info), timeout)
+        except (OSError, ValueError, asyncio.TimeoutError) as err:
+            status.metrics.metrics.add('probe_errors_total', type=type(err).__name__)
+            reachable = False
+
+        latency = time.perf_counter() - start
+
+    status.metrics.metrics.set('probe_duration_seconds', latency, service=service)
+
+    if not reachable:
+        return 'down'
+
+    if threshold is not None and latency > threshold:
+        return 'degraded'
+
+    return 'up'
+
+
+async def check_all(services, *, concurrency, timeout, deadline, degraded_after):
+    statuses = {service: None for service in services}
+
+    # every probe is scheduled up front and the semaphore bounds how many sockets are open at once
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = {asyncio.ensure_future(probe(semaphore, service, info, timeout, degraded_after)): service for service, info in services.items()}
+
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+    for task in pending:
+        task.cancel()
+
+    for task in done:
+        statuses[tasks[task]] = task.result()
+
+    if pending:
+        await asyncio.wait(pending)
+
+    return statuses
+
+
+def check(services, *, concurrency=64, timeout=10.0, deadline=None, degraded_after=None):
+    if not services:
+        return {}
+
+    return asyncio.run(check_all(services, concurrency=concurrency, timeout=timeout, deadline=deadline, degraded_after=degraded_after))
+
+
+def poll(gconfig, services, *, breaker=None):
+    # every endpoint is its own host so one failing says nothing about the rest and the breaker is left out
+    return check(services, concurrency=gconfig.getint('probe_concurrency', 64), timeout=gconfig.getfloat('timeout', 10.0), deadline=gconfig.getfloat('deadline', None), degraded_after=gconfig.getfloat('degraded_after', None))
@@ -0,0 +1,374 @@
+import asyncio
+import datetime
+import email.utils
+import hashlib
+import io
+import json
+import signal
+import sys
+import time
+import urllib.parse
+
+import dateutil.tz
+
+import status.generate
+import status.history
+import status.incident
+import status.output
+import status.site
+
+
+__all__ = ['Resource', 'StatusServer', 'serve']
+
+
+# content codings for the compressors status.output knows about
+encodings = {
+    'gzip': 'gzip',
+    'brotli': 'br',
+}
+
+content_types = {
+    '/index.html': 'text/html; charset=utf-8',
+    '/status.json': 'application/json',
+    '/feed.atom': 'application/atom+xml',
+    '/feed.rss': 'application/rss+xml',
+}
+
+reasons = {
+    200: 'OK',
+    304: 'Not Modified',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
+
+
+class Resource:
+    def __init__(self, content_type, data, modified):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.content_type = content_type
+        self.modified = email.utils.format_datetime(modified.astimezone(datetime.timezone.utc), usegmt=True)
+
+        tag = hashlib.sha256(data).hexdigest()[:32]
+
+        # each representation gets its own strong validator since the bytes differ
+        self.variants = {'identity': (data, f'"{tag}"')}
+
+        for name, (_, compressor) in status.output.compressors.items():
+            compressed = io.BytesIO()
+            compressor(io.BytesIO(data), compressed)
+
+            self.variants[encodings[name]] = (compressed.getvalue(), f'"{tag}-{encodings[name]}"')
+
+    def negotiate(self, accept_encoding):
+        accepted = {}
+
+        for coding in accept_encoding.split(','):
+            name, _, parameters = coding.strip().partition(';')
+
+            quality = 1.0
+            if parameters.strip().startswith('q='):
+                try:
+                    quality = float(parameters.strip()[2:])
+                except ValueError:
+                    pass
+
+            accepted[name.strip().lower()] = quality
+
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and accepted.get(coding, accepted.get('*', 0)) > 0:
+                return coding
+
+        return 'identity'
+
+
+def event(name, number, data):
+    return f'event: {name}\nid: {number}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('utf-8')
+
+
+def snapshot(statuses, incidents):
+    return {
+        'services': dict(statuses),
+        'incidents': {incident['name']: {'title': incident['title'], 'status': incident['status'], 'updated': incident['updated'].isoformat(timespec='milliseconds'), 'affected': incident['affected']} for incident in incidents},
+    }
+
+
+def diff(old, new):
+    changes = {}
+
+    services = {service: value for service, value in new['services'].items() if old['services'].get(service) != value}
+    if services:
+        changes['services'] = services
+
+    incidents = {name: incident for name, incident in new['incidents'].items() if old['incidents'].get(name) != incident}
+    if incidents:
+        changes['incidents'] = incidents
+
+    removed = [name for name in old['incidents'] if name not in new['incidents']]
+    if removed:
+        changes['removed'] = removed
+
+    return changes
+
+
+class StatusServer:
+    def __init__(self, config, directory, *, site=None, days=7, interval=60, poll_interval=5, timezone=None, partitioned=False, template_directory=None, rebuild_index=False, history=None, keepalive=15):
+        self.config = config
+        self.directory = directory
+        self.site_name = site
+        self.days = days
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.timezone = timezone
+        self.partitioned = partitioned
+        self.template_directory = template_directory
+        self.rebuild_index = rebuild_index
+        self.history = history
+        self.keepalive = keepalive
+
+        self.resources = {}
+        self.state = {'services': {}, 'incidents': {}}
+        self.events = 0
+        self.subscribers = set()
+        self.connections = {}
+
+        self.reload = True
+        self.changed = False
+        self.next_poll = 0
+
+        self.breaker = None
+        self.statuses = None
+        self.stale = None
+        self.uptime = None
+        self.incidents = None
+
+    def load(self):
+        gconfig, services = status.site.load_config(self.config)
+        sites = status.site.load_sites(gconfig, services, template=self.template_directory)
+
+        if self.site_name:
+            sites = [site for site in sites if site.name == self.site_name]
+            if not sites:
+                raise ValueError(f'no [SITE:{self.site_name}] section in {self.config}')
+
+        self.gconfig = gconfig
+        self.services = services
+        self.site = sites[0]
+
+        # a SIGHUP reload keeps the backoff already under way
+        self.breaker = status.site.make_breaker(gconfig, state=(self.breaker.state() if self.breaker else None))
+
+        self.statuses = None
+        self.incidents = None
+        self.next_poll = 0
+
+    def update(self):
+        if self.reload:
+            self.load()
+            self.reload = False
+
+        now = datetime.datetime.now().astimezone(dateutil.tz.gettz(self.timezone))
+
+        if time.monotonic() >= self.next_poll:
+            statuses, stale = status.site.poll(self.gconfig, self.services, breaker=self.breaker)
+            self.next_poll = time.monotonic() + self.interval
+
+            if self.history:
+                status.history.record(self.history, now, {service: ('unknown' if service in stale else value) for service, value in statuses.items()})
+                uptime = status.history.uptime(self.history, self.services, now)
+            else:
+                uptime = None
+
+            if (statuses, stale, uptime) != (self.statuses, self.stale, self.uptime):
+                self.statuses, self.stale, self.uptime = statuses, stale, uptime
+                self.changed = True
+
+        incidents = status.site.collect(self.directory, now, self.days, timezone=self.timezone, partitioned=self.partitioned, rebuild_index=self.rebuild_index)
+        self.rebuild_index = False
+
+        if incidents != self.incidents:
+            self.incidents = incidents
+            self.changed = True
+
+        # a change stays pending until it has been rendered so a failed refresh is retried on the next one
+        if not self.changed:
+            return None
+
+        site = self.site
+        statuses = site.statuses(self.statuses)
+        index = status.incident.IncidentIndex(site.incidents(self.incidents))
+
+        entries = site.config.getint('feed_entries', None)
+        atom, rss = status.generate.generate_feeds(site.config, now, index[:entries])
+
+        resources = {
+            '/index.html': Resource(content_types['/index.html'], status.generate.generate_html(site.config, now, site.services, statuses, index, templates=site.templates, uptime=self.uptime), now),
+            '/status.json': Resource(content_types['/status.json'], status.generate.generate_json(site.config, now, site.services, statuses, index, uptime=self.uptime, stale=self.stale), now),
+            '/feed.atom': Resource(content_types['/feed.atom'], atom, now),
+            '/feed.rss': Resource(content_types['/feed.rss'], rss, now),
+        }
+
+        status.generate.render_cache.prune()
+
+        self.changed = False
+
+        return resources, snapshot(statuses, index.active)
+
+    def publish(self, resources, state):
+        self.resources = resources
+        self.resources['/'] = resources['/index.html']
+
+        changes = diff(self.state, state)
+        self.state = state
+
+        if not changes:
+            return
+
+        self.events += 1
+        message = event('diff', self.events, changes)
+
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # a client that stopped reading is dropped rather than buffering for it forever
+                self.subscribers.discard(queue)
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                # polling and rendering block so they run off the event loop
+                result = await loop.run_in_executor(None, self.update)
+            except Exception as err:
+                # keep serving the last good outputs and try again on the next refresh
+                print(f'status: refresh failed: {err!r}', file=sys.stderr, flush=True)
+                result = None
+
+            if result:
+                self.publish(*result)
+
+            await asyncio.sleep(min(self.poll_interval, max(self.next_poll - time.monotonic(), 0)))
+
+    async def respond(self, writer, code, headers, body=b''):
+        head = f'HTTP/1.1 {code} {reasons[code]}\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers.items()) + '\r\n'
+
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def stream_events(self, writer):
+        queue = asyncio.Queue(maxsize=64)
+        self.subscribers.add(queue)
+
+        try:
+            await self.respond(writer, 200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}, event('snapshot', self.events, self.state))
+
+            while queue in self.subscribers:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+
+                if message is None:
+                    break
+
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self.subscribers.discard(queue)
+
+    async def handle(self, reader, writer):
+        self.connections[asyncio.current_task()] = writer
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                path = urllib.parse.urlsplit(target).path
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if method not in ('GET', 'HEAD'):
+                    await self.respond(writer, 405, {'Allow': 'GET, HEAD', 'Content-Length': '0'})
+                elif path == '/events':
+                    await self.stream_events(writer)
+                    break
+                elif path not in self.resources:
+                    await self.respond(writer, 404, {'Content-Length': '0'})
+                else:
+                    resource = self.resources[path]
+                    coding = resource.negotiate(headers.get('accept-encoding', ''))
+                    body, etag = resource.variants[coding]
+
+                    response_headers = {'Content-Type': resource.content_type, 'ETag': etag, 'Last-Modified': resource.modified, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+                    # If-None-Match uses the weak comparison so a W/ prefix still matches
+                    if_none_match = [tag.strip().removeprefix('W/') for tag in headers.get('if-none-match', '').split(',')]
+
+                    if etag in if_none_match or '*' in if_none_match:
+                        await self.respond(writer, 304, response_headers)
+                    else:
+                        if coding != 'identity':
+                            response_headers['Content-Encoding'] = coding
+                        response_headers['Content-Length'] = str(len(body))
+
+                        await self.respond(writer, 200, response_headers, body if method == 'GET' else b'')
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        loop = asyncio.get_running_loop()
+
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: setattr(self, 'reload', True))
+
+        # the first generation finishes before the socket opens so nothing is ever served empty
+        self.publish(*(await loop.run_in_executor(None, self.update)))
+
+        server = await asyncio.start_server(self.handle, host, port)
+        refresh = asyncio.ensure_future(self.refresh())
+
+        async with server:
+            await stop.wait()
+
+            server.close()
+            refresh.cancel()
+
+            # event streams end and idle connections are closed so every handler finishes on its own
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    self.subscribers.discard(queue)
+
+            for writer in self.connections.values():
+                writer.close()
+
+            if self.connections:
+                await asyncio.wait(list(self.connections), timeout=5)
+
+
+def serve(config, directory, *, host='127.0.0.1', port=8000, **options):
+    asyncio.run(StatusServer(config, directory, **options).serve(host, port))
@@ -0,0 +1,382 @@
+import configparser
+import datetime
+import hashlib
+import json
+import os
+import os.path
+import re
+import time
+
+import status.cache
+import status.generate
+import status.grafana
+import status.incident
+import status.metrics
+import status.output
+import status.probe
+
+
+__all__ = ['outputs', 'cache_filename', 'backends', 'Site', 'load_config', 'load_sites', 'open_cache', 'make_breaker', 'poll', 'collect', 'collect_all', 'write', 'write_html_archive']
+
+
+outputs = ['index.html', 'status.json', 'feed.atom', 'feed.rss']
+
+cache_filename = '.status-cache.json'
+
+# each backend polls the services using it and reports None for any it could not get an answer for
+backends = {
+    'grafana': status.grafana,
+    'http': status.probe,
+    'tcp': status.probe,
+}
+
+
+def load_config(filename):
+    config = configparser.ConfigParser()
+    config.read(filename)
+
+    if 'GLOBAL' not in config:
+        raise ValueError(f'no [GLOBAL] section in {filename}')
+
+    services = {section: config[section] for section in config.sections() if section != 'GLOBAL' and not section.startswith('SITE:')}
+
+    # checked on loading so a bad backend stops a daemon at startup instead of failing every poll
+    for service, info in services.items():
+        if info.get('backend', 'grafana') not in backends:
+            raise ValueError(f'[{service}] has unknown backend {info["backend"]}')
+
+    gconfig = config['GLOBAL']
+
+    return gconfig, services
+
+
+class Site:
+    def __init__(self, name, config, services, output, templates, *, restricted=False):
+        self.name = name
+        self.config = config
+        self.services = services
+        self.output = output
+        self.templates = templates
+        self.restricted = restricted
+
+    def statuses(self, statuses):
+        return {service: statuses[service] for service in self.services}
+
+    def incidents(self, incidents):
+        if not self.restricted:
+            return incidents
+
+        # sites showing a subset of services keep general notices and incidents touching one of their services
+        return [incident for incident in incidents if not incident['affected'] or any(service in self.services for service in incident['affected'])]
+
+
+def load_sites(gconfig, services, *, output='.', template=None):
+    parser = gconfig.parser
+    sections = [section for section in parser.sections() if section.startswith('SITE:')]
+
+    if not sections:
+        return [Site(None, gconfig, services, output, status.generate.TemplateSet(template))]
+
+    templates = {}
+    sites = []
+
+    for section in sections:
+        site = parser[section]
+
+        if 'output' not in site:
+            raise ValueError(f'[{section}] needs an output directory')
+
+        # site settings override [GLOBAL] ones and the merged values are already interpolated
+        merged = configparser.ConfigParser(interpolation=None)
+        merged.read_dict({'GLOBAL': {**gconfig, **site}})
+
+        if 'services' in site:
+            names = [name for name in re.split(r'[\s,]+', site['services']) if name]
+
+            for name in names:
+                if name not in services:
+                    raise ValueError(f'[{section}] lists unknown service {name}')
+
+            site_services = {name: services[name] for name in names}
+        else:
+            site_services = services
+
+        # sites sharing a template directory share its parsed templates
+        template_directory = site.get('template', template)
+        if template_directory not in templates:
+            templates[template_directory] = status.generate.TemplateSet(template_directory)
+
+        sites.append(Site(section[len('SITE:'):], merged['GLOBAL'], site_services, site['output'], templates[template_directory], restricted=('services' in site)))
+
+    return sites
+
+
+def open_cache(gconfig, output=None):
+    ttl = gconfig.getfloat('cache_ttl', None)
+
+    # an explicit cache path wins over keeping the cache next to the outputs
+    filename = gconfig.get('cache') or (os.path.join(output, cache_filename) if output else None)
+
+    return status.cache.StatusCache(filename, ttl=ttl) if filename and ttl else None
+
+
+def make_breaker(gconfig, *, output=None, state=None):
+    # without a state of its own the breaker carries on from what the cache kept
+    if state is None:
+        cache = open_cache(gconfig, output)
+        state = cache.breaker if cache else {}
+
+    return status.grafana.CircuitBreaker(threshold=gconfig.getint('breaker_threshold', 5), backoff=gconfig.getfloat('breaker_backoff', 300.0), **state)
+
+
+def poll(gconfig, services, *, output=None, breaker=None):
+    cache = open_cache(gconfig, output)
+
+    # resident processes hand in the breaker they keep across polls while single runs rely on the cache to back off from an unreachable Grafana
+    if breaker is None:
+        breaker = make_breaker(gconfig, state=(cache.breaker if cache else {}))
+
+    groups = {}
+    for service, info in services.items():
+        groups.setdefault(backends[info.get('backend', 'grafana')], {})[service] = info
+
+    statuses = {}
+    for backend, group in groups.items():
+        statuses.update(backend.poll(gconfig, group, breaker=breaker))
+
+    # keep the configured service order whichever backend answered first
+    statuses = {service: statuses[service] for service in services}
+
+    if not cache:
+        return {service: value or 'unknown' for service, value in statuses.items()}, {}
+
+    statuses, stale = cache.resolve(time.time(), statuses)
+
+    cache.breaker = breaker.state()
+    cache.save()
+
+    return statuses, stale
+
+
+def collect(directory, now, days, *, timezone=None, partitioned=False, rebuild_index=False):
+    since = now - datetime.timedelta(days=(days or 0))
+
+    incidents = status.incident.get_all(directory, timezone, content=False, partitioned=partitioned, since=since, rebuild_index=rebuild_index)
+
+    for incident in incidents[:]:
+        if days and incident['updated'] >= since:
+            continue
+
+        if incident['status'] == 'notice' or incident['status'] == 'resolved':
+            incidents.remove(incident)
+            status.metrics.metrics.add('incidents_filtered')
+
+    for incident in incidents:
+        status.incident.load_content(directory, incident, partitioned=partitioned)
+
+    return incidents
+
+
+def collect_all(directory, *, timezone=None, partitioned=False):
+    # every incident ever written is listed from the incident index and only the pages being rewritten read any content
+    incidents = status.incident.get_all(directory, timezone, content=False, partitioned=partitioned)
+
+    for incident in incidents:
+        status.incident.load_content(directory, incident, partitioned=partitioned)
+
+    return incidents
+
+
+def write(output, gconfig, now, services, statuses, incidents, *, templates=None, only=None, compress=(), jobs=1, uptime=None, stale=None, archive=None):
+    os.makedirs(output, exist_ok=True)
+
+    index = status.incident.IncidentIndex(incidents)
+
+    service_pages = gconfig.getboolean('service_pages', False)
+    if service_pages:
+        os.makedirs(os.path.join(output, 'services'), exist_ok=True)
+
+    if not only or 'index.html' in only:
+        with status.metrics.metrics.stage('prerender'):
+            status.generate.prerender(index, jobs)
+
+        with status.metrics.metrics.stage('html'), status.output.Output(os.path.join(output, 'index.html'), compress=compress) as output_html:
+            status.generate.write_html(output_html, gconfig, now, services, statuses, index, templates=templates, uptime=uptime)
+
+        if service_pages:
+            with status.metrics.metrics.stage('service_html'):
+                for service in statuses:
+                    with status.output.Output(os.path.join(output, 'services', service + '.html'), compress=compress) as output_html:
+                        status.generate.write_service_html(output_html, gconfig, now, service, services, statuses, index, templates=templates, uptime=uptime)
+
+    if not only or 'status.json' in only:
+        with status.metrics.metrics.stage('json'):
+            pages = write_json_pages(output, gconfig, index, compress=compress)
+
+            with status.output.Output(os.path.join(output, 'status.json'), compress=compress) as output_json:
+                status.generate.write_json(output_json, gconfig, now, services, statuses, index, uptime=uptime, stale=stale, pages=pages)
+
+    if not only or 'feed.atom' in only or 'feed.rss' in only:
+        with status.metrics.metrics.stage('feeds'):
+            write_feeds(output, gconfig, now, services, statuses, index, service_pages=service_pages, compress=compress, archive=archive)
+
+
+def signature(incidents, *extra):
+    page_hash = hashlib.sha256(json.dumps(extra).encode('utf-8'))
+
+    for incident in incidents:
+        page_hash.update('\0'.join([incident['name'], incident['title'], incident['date'].isoformat(), incident['updated'].isoformat(), incident['status'], '\x1f'.join(incident['affected']), incident['content'], '']).encode('utf-8'))
+
+    return page_hash.hexdigest()
+
+
+def file_signature(incidents, *extra):
+    page_hash = hashlib.sha256(json.dumps(extra).encode('utf-8'))
+
+    # an incident file changing on disk changes its mtime and size so pages are checked without reading them
+    for incident in incidents:
+        stat = os.stat(incident.filename)
+        page_hash.update(f'{incident["name"]}\0{incident["date"].isoformat()}\0{stat.st_mtime_ns}\0{stat.st_size}\0'.encode('utf-8'))
+
+    return page_hash.hexdigest()
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, '.manifest.json'), 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def remove_stale(directory, manifest, new_manifest, extension):
+    for name in manifest:
+        if name not in new_manifest:
+            for compressed in [''] + ['.' + compressed for compressed, _ in status.output.compressors.values()]:
+                try:
+                    os.remove(os.path.join(directory, name + extension + compressed))
+                except FileNotFoundError:
+                    pass
+
+    if new_manifest != manifest:
+        status.output.write(os.path.join(directory, '.manifest.json'), json.dumps(new_manifest, indent=2) + '\n')
+
+
+def write_json_pages(output, gconfig, index, *, compress=()):
+    pages_directory = os.path.join(output, 'incidents')
+    os.makedirs(pages_directory, exist_ok=True)
+
+    # one page per month like archive/ so pages only change when their own incidents do, wherever the retention window starts
+    pages = {}
+    for incident in index.chronological:
+        pages.setdefault(incident['date'].strftime('%Y-%m'), []).append(incident)
+
+    names = list(pages)
+
+    manifest = load_manifest(pages_directory)
+    new_manifest = {}
+
+    for position, name in enumerate(names):
+        prev_page = names[position - 1] + '.json' if position > 0 else None
+        next_page = names[position + 1] + '.json' if position + 1 < len(names) else None
+
+        page = pages[name][::-1]
+
+        new_manifest[name] = signature(page, prev_page, next_page)
+
+        filename = os.path.join(pages_directory, name + '.json')
+        if manifest.get(name) == new_manifest[name] and os.path.exists(filename):
+            continue
+
+        with status.output.Output(filename, compress=compress) as output_json:
+            status.generate.write_json_page(output_json, name, page, prev_page=prev_page, next_page=next_page)
+
+    remove_stale(pages_directory, manifest, new_manifest, '.json')
+
+    return ['incidents/' + name + '.json' for name in reversed(names)]
+
+
+def write_feeds(output, gconfig, now, services, statuses, index, *, service_pages=False, compress=(), archive=None):
+    entries = gconfig.getint('feed_entries', None)
+
+    if entries and gconfig.getboolean('feed_archive', False):
+        # archive pages take every incident on disk that is not in the main feed so they keep incidents past the retention window
+        current = {incident['name'] for incident in index[:entries]}
+        prev_archive = write_archive(output, gconfig, now, [incident for incident in (index if archive is None else archive) if incident['name'] not in current], compress=compress)
+    else:
+        prev_archive = None
+
+    atom, rss = status.generate.generate_feeds(gconfig, now, index[:entries], prev_archive=prev_archive)
+
+    status.output.write(os.path.join(output, 'feed.atom'), atom, compress=compress)
+    status.output.write(os.path.join(output, 'feed.rss'), rss, compress=compress)
+
+    if service_pages:
+        for service in statuses:
+            status.output.write(os.path.join(output, 'services', service + '.atom'), status.generate.generate_service_atom(gconfig, now, service, services, index), compress=compress)
+
+
+def write_archive(output, gconfig, now, incidents, *, compress=()):
+    archive_directory = os.path.join(output, 'archive')
+    os.makedirs(archive_directory, exist_ok=True)
+
+    # monthly pages keep older archive documents stable as newer incidents roll out of the main feed
+    pages = {}
+    for incident in sorted(incidents, key=(lambda incident: incident['date'])):
+        pages.setdefault(incident['date'].strftime('%Y-%m'), []).append(incident)
+
+    names = list(pages)
+
+    manifest = load_manifest(archive_directory)
+    new_manifest = {}
+
+    for position, name in enumerate(names):
+        prev_archive = names[position - 1] + '.atom' if position > 0 else None
+        next_archive = names[position + 1] + '.atom' if position + 1 < len(names) else None
+
+        page = pages[name][::-1]
+
+        new_manifest[name] = file_signature(page, gconfig['title'], prev_archive, next_archive)
+
+        filename = os.path.join(archive_directory, name + '.atom')
+        if manifest.get(name) == new_manifest[name] and os.path.exists(filename):
+            continue
+
+        status.output.write(filename, status.generate.generate_archive_atom(gconfig, now, name, page, current='../feed.atom', prev_archive=prev_archive, next_archive=next_archive), compress=compress)
+
+    remove_stale(archive_directory, manifest, new_manifest, '.atom')
+
+    return 'archive/' + names[-1] + '.atom' if names else None
+
+
+def write_html_archive(output, gconfig, services, incidents, *, templates=None, compress=()):
+    if not templates:
+        templates = status.generate.TemplateSet()
+
+    history_directory = os.path.join(output, 'history')
+    os.makedirs(history_directory, exist_ok=True)
+
+    months = {}
+    for incident in incidents:
+        months.setdefault(incident['date'].strftime('%Y-%m'), []).append(incident)
+
+    # the site's services decide both which incidents it lists and how they are shown
+    rendering = [gconfig['title'], {service: [info['title'], info['link']] for service, info in services.items()}, templates.templates]
+
+    manifest = load_manifest(history_directory)
+    new_manifest = {}
+
+    for name, page in months.items():
+        new_manifest[name] = file_signature(page, rendering)
+
+        filename = os.path.join(history_directory, name + '.html')
+        if manifest.get(name) == new_manifest[name] and os.path.exists(filename):
+            continue
+
+        with status.output.Output(filename, compress=compress) as output_html:
+            status.generate.write_history_html(output_html, gconfig, name, services, page, templates=templates)
+
+    remove_stale(history_directory, manifest, new_manifest, '.html')
+
+    with status.output.Output(os.path.join(history_directory, 'index.html'), compress=compress) as output_html:
+        status.generate.write_history_index_html(output_html, gconfig, {name: len(page) for name, page in months.items()}, templates=templates)
@@ -0,0 +1,249 @@
+import ctypes
+import ctypes.util
+import datetime
+import os
+import os.path
+import select
+import signal
+import struct
+import sys
+import time
+
+import dateutil.tz
+
+import status.generate
+import status.history
+import status.metrics
+import status.site
+
+
+__all__ = ['watch']
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+
+inotify_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+inotify_event = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    def __init__(self, directory):
+        self.directory = directory
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        self.add_watches()
+
+    def add_watches(self):
+        for path, _, _ in os.walk(self.directory):
+            # adding an existing watch again just returns its descriptor
+            if self.libc.inotify_add_watch(self.fd, os.fsencode(path), inotify_mask) < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self):
+        changed = False
+        new_directory = False
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = inotify_event.unpack_from(data, offset)
+                name = data[offset + inotify_event.size:offset + inotify_event.size + length].rstrip(b'\0')
+                offset += inotify_event.size + length
+
+                if mask & IN_ISDIR:
+                    changed = True
+                    new_directory = new_directory or bool(mask & (IN_CREATE | IN_MOVED_TO))
+                elif name.endswith(b'.md'):
+                    changed = True
+
+        if new_directory:
+            self.add_watches()
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch(config, directory, output, *, days=7, interval=60, poll_interval=5, timezone=None, partitioned=False, template_directory=None, rebuild_index=False, compress=(), jobs=1, timings=False, metrics_file=None, history=None):
+    stop = False
+    reload = True
+
+    def handle_term(signum, frame):
+        nonlocal stop
+        stop = True
+
+    def handle_hup(signum, frame):
+        nonlocal reload
+        reload = True
+
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGTERM, handle_term)
+    signal.signal(signal.SIGINT, handle_term)
+    signal.signal(signal.SIGHUP, handle_hup)
+
+    # without inotify the incident directory is simply rescanned every poll_interval seconds
+    try:
+        watcher = InotifyWatcher(directory)
+    except (OSError, AttributeError):
+        watcher = None
+
+    sites = None
+    breaker = None
+    statuses = None
+    stale = None
+    incidents = None
+    uptime = None
+    archive_signature = None
+
+    # outputs stay pending until written so a change seen by a failed iteration is written by a later one
+    changed = set()
+    failed = False
+
+    next_poll = 0
+
+    try:
+        while not stop:
+            try:
+                if reload:
+                    gconfig, services = status.site.load_config(config)
+                    sites = status.site.load_sites(gconfig, services, output=output, template=template_directory)
+                    # the breaker outlives reloads so a reload does not hammer a Grafana it is backing off from
+                    breaker = status.site.make_breaker(gconfig, output=sites[0].output, state=(breaker.state() if breaker else None))
+                    statuses = None
+                    stale = None
+                    incidents = None
+                    uptime = None
+                    archive_signature = None
+                    next_poll = 0
+                    reload = False
+
+                if timings or metrics_file:
+                    status.metrics.metrics = status.metrics.Metrics()
+
+                metrics = status.metrics.metrics
+
+                now = datetime.datetime.now().astimezone(dateutil.tz.gettz(timezone))
+
+                if time.monotonic() >= next_poll:
+                    with metrics.stage('poll'):
+                        new_statuses, new_stale = status.site.poll(gconfig, services, output=sites[0].output, breaker=breaker)
+                    next_poll = time.monotonic() + interval
+
+                    if new_statuses != statuses:
+                        statuses = new_statuses
+                        changed.update(['index.html', 'status.json'])
+
+                    if new_stale != stale:
+                        stale = new_stale
+                        changed.add('status.json')
+
+                    if history:
+                        with metrics.stage('history'):
+                            status.history.record(history, now, {service: ('unknown' if service in new_stale else value) for service, value in new_statuses.items()})
+                            new_uptime = status.history.uptime(history, services, now)
+
+                        if new_uptime != uptime:
+                            uptime = new_uptime
+                            changed.update(['index.html', 'status.json'])
+
+                # retention depends on the current time so the incident list is recollected on every wake up
+                with metrics.stage('collect'):
+                    new_incidents = status.site.collect(directory, now, days, timezone=timezone, partitioned=partitioned, rebuild_index=rebuild_index)
+                rebuild_index = False
+
+                if new_incidents != incidents:
+                    incidents = new_incidents
+                    changed.update(status.site.outputs)
+
+                    if len(sites) > 1:
+                        status.generate.render_cache.size = max(status.generate.render_cache.size, 2 * len(incidents))
+
+                archive = None
+                if any(site.config.getboolean('feed_archive', False) or site.config.getboolean('html_archive', False) for site in sites):
+                    with metrics.stage('collect_all'):
+                        archive = status.site.collect_all(directory, timezone=timezone, partitioned=partitioned)
+
+                # edits to incidents past the retention window only change the archive pages the feeds link to
+                if any(site.config.getboolean('feed_archive', False) for site in sites):
+                    new_archive_signature = status.site.file_signature(archive)
+                    if new_archive_signature != archive_signature:
+                        archive_signature = new_archive_signature
+                        changed.update(['feed.atom', 'feed.rss'])
+
+                for site in sites:
+                    # edits to incidents older than the retention window only show up in the monthly archive
+                    if site.config.getboolean('html_archive', False):
+                        with metrics.stage('html_archive'):
+                            status.site.write_html_archive(site.output, site.config, site.services, site.incidents(archive), templates=site.templates, compress=compress)
+
+                    if changed:
+                        status.site.write(site.output, site.config, now, site.services, site.statuses(statuses), site.incidents(incidents), templates=site.templates, only=changed, compress=compress, jobs=jobs, uptime=uptime, stale=stale, archive=(site.incidents(archive) if archive is not None else None))
+
+                if changed:
+                    changed = set()
+
+                    status.generate.render_cache.prune()
+
+                    if metrics_file:
+                        metrics.write(metrics_file)
+
+                    if timings:
+                        metrics.report(sys.stderr)
+
+                failed = False
+            except Exception as err:
+                # a configuration that never loaded is not worth retrying
+                if sites is None:
+                    raise
+
+                # one bad incident file or a failed write must not end the daemon so the iteration is retried after poll_interval
+                print(f'status: update failed: {err!r}', file=sys.stderr, flush=True)
+                failed = True
+
+            wake = next_poll if watcher and not failed else min(next_poll, time.monotonic() + poll_interval)
+            readers = [wakeup_read] + ([watcher] if watcher else [])
+
+            while not stop and (not reload or failed):
+                ready, _, _ = select.select(readers, [], [], max(wake - time.monotonic(), 0))
+
+                if not ready:
+                    break
+
+                if wakeup_read in ready:
+                    try:
+                        os.read(wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+
+                if watcher in ready and watcher.changed():
+                    break
+    finally:
+        if watcher:
+            watcher.close()
+
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_read)
+        os.close(wakeup_write)
@@ -0,0 +1,148 @@
+import configparser
+import datetime
+import os
+import os.path
+
+import pytest
+
+import status.generate
+import status.grafana
+import status.incident
+import status.site
+
+import benchmarks.corpus
+import benchmarks.grafana
+
+
+def make_services(count):
+    return {f'service{index}': {'id': str(index + 1), 'title': f'Service {index}', 'link': f'https://example.com/service{index}', 'description': f'Service {index}'} for index in range(count)}
+
+
+def test_bulk_check_makes_one_request():
+    services = make_services(20)
+
+    states = {alert_id: 'ok' for alert_id in range(1, 21)}
+    states.update({1: 'alerting', 2: 'paused'})
+
+    with benchmarks.grafana.FakeGrafana(states=states) as fake:
+        statuses = status.grafana.check(fake.api_base, 'test', services, bulk=True)
+
+        assert fake.requests == 1
+
+    assert statuses['service0'] == 'down'
+    assert statuses['service1'] == 'maintenance'
+    assert all(statuses[service] == 'up' for service in list(services)[2:])
+
+
+def test_bulk_check_falls_back_for_missing_alerts():
+    services = make_services(20)
+
+    with benchmarks.grafana.FakeGrafana(states={alert_id: 'ok' for alert_id in range(1, 21)}, missing={3, 7, 11}) as fake:
+        statuses = status.grafana.check(fake.api_base, 'test', services, bulk=True)
+
+        # one listing of every alert and then one request for each alert it left out
+        assert fake.requests == 1 + 3
+
+    assert [service for service, value in statuses.items() if value == 'unknown'] == ['service2', 'service6', 'service10']
+
+
+def test_check_without_bulk_makes_one_request_per_alert():
+    services = make_services(10)
+    services['service9']['id'] = services['service8']['id']
+
+    with benchmarks.grafana.FakeGrafana() as fake:
+        statuses = status.grafana.check(fake.api_base, 'test', services)
+
+        assert fake.requests == 9
+
+    assert all(value == 'up' for value in statuses.values())
+
+
+def test_check_leaves_services_without_id_failed():
+    services = make_services(3)
+    del services['service1']['id']
+
+    with benchmarks.grafana.FakeGrafana() as fake:
+        statuses = status.grafana.check(fake.api_base, 'test', services)
+
+        assert fake.requests == 2
+
+    assert statuses == {'service0': 'up', 'service1': 'unknown', 'service2': 'up'}
+
+
+def test_poll_keeps_backing_off_with_a_shared_breaker():
+    services = make_services(3)
+
+    with benchmarks.grafana.FakeGrafana(failure_rate=1.0) as fake:
+        config = configparser.ConfigParser()
+        config.read_dict({'GLOBAL': {'api_base': fake.api_base, 'api_key': 'test', 'breaker_threshold': '2'}})
+
+        breaker = status.site.make_breaker(config['GLOBAL'])
+
+        for _ in range(3):
+            statuses, _ = status.site.poll(config['GLOBAL'], services, breaker=breaker)
+
+        # the breaker opened during the first poll so the later ones never reach Grafana
+        assert fake.requests == 3
+
+    assert all(value == 'unknown' for value in statuses.values())
+
+
+def test_indexed_get_all_matches_full_parse(tmp_path):
+    directory = str(tmp_path)
+    names = benchmarks.corpus.generate(directory, 100, list(make_services(10)), partitioned=True)
+
+    parsed = sorted((status.incident.get(directory, name, partitioned=True) for name in names), key=(lambda incident: incident['date']), reverse=True)
+
+    cold = status.incident.get_all(directory, partitioned=True, rebuild_index=True)
+    warm = status.incident.get_all(directory, partitioned=True)
+
+    assert os.path.exists(os.path.join(directory, status.incident.index_filename))
+    assert cold == parsed
+    assert warm == parsed
+
+
+def test_jobs_output_is_identical(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'incidents')
+    services = make_services(10)
+
+    benchmarks.corpus.generate(directory, 200, list(services))
+
+    config = configparser.ConfigParser()
+    config.read_dict({'GLOBAL': {'title': 'Test Status', 'service_pages': 'yes'}})
+
+    now = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+    statuses = {service: 'up' for service in services}
+
+    outputs = {}
+
+    for jobs in (1, 4):
+        # a fresh cache so every incident is rendered by the jobs being compared
+        monkeypatch.setattr(status.generate, 'render_cache', status.generate.RenderCache())
+
+        output = str(tmp_path / f'output-{jobs}')
+        status.site.write(output, config['GLOBAL'], now, services, statuses, status.incident.get_all(directory), jobs=jobs)
+
+        outputs[jobs] = {}
+        for path, _, filenames in os.walk(output):
+            for filename in filenames:
+                with open(os.path.join(path, filename), 'rb') as output_file:
+                    outputs[jobs][os.path.relpath(os.path.join(path, filename), output)] = output_file.read()
+
+    assert outputs[1] == outputs[4]
+
+
+def test_batch_rejects_fields_of_the_wrong_type(tmp_path):
+    directory = str(tmp_path)
+
+    for operation, message in [
+        ({'op': 'create', 'title': 'Outage', 'affected': 'web'}, 'affected must be a list of strings'),
+        ({'op': 'create', 'title': 'Outage', 'affected': ['web', 1]}, 'affected must be a list of strings'),
+        ({'op': 'create', 'title': 42}, 'title must be a string'),
+        ({'op': 'create', 'title': 'Outage', 'content': ['text']}, 'content must be a string'),
+        ({'op': 'edit', 'name': 7}, 'name must be a string'),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            status.incident.batch(directory, [operation])
+
+    assert os.listdir(directory) == []